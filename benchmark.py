@@ -0,0 +1,266 @@
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from buffers import DropQueue, PlotBuffer
+from metrics import Metrics, clock
+from models import get_model
+from pipeline import Pipeline
+from sources import FileSource
+
+
+class StandInClassifier(object):
+    """
+    Fixed random two layer model in place of a trained PKL, so the benchmark needs no model file and the predict
+    cost can be scaled with size
+    """
+    def __init__(self, width, size=256, classes=4, seed=0):
+        """
+        Initialize the model
+        :param width: Number of inputs, the spectrum bins or features of a window
+        :param size: Number of hidden units
+        :param classes: Number of predicted classes
+        :param seed: Seed of the random weights
+        """
+        rng = np.random.RandomState(seed)
+        self.hidden = rng.randn(width, size) / np.sqrt(width)
+        self.output = rng.randn(size, classes)
+        # Trained on whatever the pipeline produces
+        self.features_ = None
+
+    def predict(self, X):
+        return np.argmax(np.maximum(np.dot(X, self.hidden), 0.).dot(self.output), axis=1) + 1
+
+
+class Monitor(object):
+    """
+    Does what an Algorithm and the UI slot do for every batch: predict, then add each prediction to a plot buffer
+    """
+    def __init__(self, clf, pipeline, metrics):
+        self.clf = clf
+        self.pipeline = pipeline
+        self.metrics = metrics
+        self.plot = PlotBuffer(100)
+        self.windows = 0
+
+    def process(self, spectra):
+        start = clock()
+        pred = self.clf.predict(spectra)
+        self.metrics.since("predict", start)
+        start = clock()
+        for p in pred:
+            self.plot.append(self.windows, p)
+            self.windows += 1
+        self.metrics.since("plot", start)
+        # From the moment the oldest window of the batch was complete to its prediction being shown
+        self.metrics.record("window", time.time() - self.pipeline.batch_time)
+
+
+def synthetic(rate, seconds, seed=0):
+    """
+    Reproducible test audio: a few machining-like tones with a slow amplitude drift, plus noise
+    :param rate: Sampling rate
+    :param seconds: Length in seconds
+    :param seed: Seed of the noise
+    :return: float32 array
+    """
+    t = np.arange(int(rate * seconds)) / float(rate)
+    audio = 0.05 * np.random.RandomState(seed).randn(t.size)
+    for frequency, amplitude in ((440., 0.3), (1800., 0.2), (6200., 0.1)):
+        audio += amplitude * (1. + 0.5 * np.sin(2 * np.pi * 0.1 * t)) * np.sin(2 * np.pi * frequency * t)
+    return audio.astype(np.float32)
+
+
+def rss():
+    """
+    Resident memory of this process
+    :return: Bytes, or 0 where it can not be read
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        # Peak rather than current, in kilobytes on Linux and bytes on macOS
+        scale = 1 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    except ImportError:
+        return 0
+
+
+def run(audio, rate, window_length, hop_length, batch_size, features, n_features, model_size, chunk_size,
+        clf=None, seed=0):
+    """
+    Push audio through the capture queue, the pipeline and a classifier as fast as possible
+    :param audio: float32 samples
+    :param rate: Sampling rate of the audio
+    :param clf: Classifier to use, None for a StandInClassifier of model_size hidden units
+    :return: Dictionary of results
+    :raises ValueError: When clf was trained on other features than the configuration produces
+    """
+    # Offline, so every duration is kept and the percentiles are exact
+    metrics = Metrics(keep=True)
+    pipeline = Pipeline(rate=rate, window_length=window_length, hop_length=hop_length, batch_size=batch_size,
+                        max_latency=float('inf'), features=features, n_features=n_features, metrics=metrics)
+    if clf is None:
+        clf = StandInClassifier(pipeline.batch.shape[1], size=model_size, seed=seed)
+    else:
+        pipeline.check_features(clf)
+    monitor = Monitor(clf, pipeline, metrics)
+    pipeline.register(monitor)
+    # The same hand over as CaptureEngine: the callback queues a chunk, the capture thread takes it
+    chunks = DropQueue(maxsize=64)
+
+    # The first second warms up caches and allocations, memory growth is counted after it
+    warmup = min(int(rate), audio.size // 10)
+    pipeline.feed(audio[:warmup])
+    memory_start = rss()
+    start = time.time()
+    for offset in range(warmup, audio.size, chunk_size):
+        chunk = audio[offset:offset + chunk_size]
+        put = clock()
+        chunks.put((put, chunk))
+        metrics.since("callback", put)
+        received, chunk = chunks.get()
+        metrics.since("queue", received)
+        pipeline.feed(chunk)
+    pipeline.flush()
+    elapsed = time.time() - start
+    memory_end = rss()
+
+    result = dict(rate=rate, window_length=window_length, hop_length=hop_length or window_length,
+                  batch_size=batch_size, features=features, n_features=n_features, model_size=model_size,
+                  chunk_size=chunk_size, windows=monitor.windows, seconds=elapsed,
+                  windows_per_sec=monitor.windows / elapsed if elapsed else 0.,
+                  realtime_factor=(audio.size - warmup) / float(rate) / elapsed if elapsed else 0.,
+                  rss_start=memory_start, rss_end=memory_end, rss_growth=memory_end - memory_start)
+    for name, h in metrics.stages():
+        for q in (50, 90, 99):
+            result[name + "_p" + str(q) + "_ms"] = float(np.percentile(h.samples, q)) * 1000.
+        result[name + "_max_ms"] = h.max * 1000.
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """
+    Find configurations that got slower than in a previous run
+    :param results: Results of this run
+    :param baseline: Path of the JSON lines output of a previous run
+    :param tolerance: Fraction of the baseline throughput that may be lost
+    :return: List of messages, empty when nothing regressed
+    """
+    keys = ("rate", "window_length", "hop_length", "batch_size", "features", "n_features", "model_size")
+    previous = dict()
+    with open(baseline) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                previous[tuple(record[k] for k in keys)] = record
+    messages = []
+    for result in results:
+        before = previous.get(tuple(result[k] for k in keys))
+        if before is not None and result['windows_per_sec'] < before['windows_per_sec'] * (1. - tolerance):
+            messages.append("Regression " + ", ".join(k + "=" + str(result[k]) for k in keys) +
+                            ": {:0.0f} windows/s, was {:0.0f}".format(result['windows_per_sec'],
+                                                                       before['windows_per_sec']))
+    return messages
+
+
+def main(args):
+    """
+    Benchmark every combination of the given settings
+    :param args: Parsed command line arguments
+    :return: int: Exit code, 1 when a configuration regressed against the baseline
+    """
+    def values(text, kind):
+        return [kind(v) for v in text.split(",") if v]
+
+    clf = None
+    if args.clf_path:
+        clf = get_model(args.clf_path)
+
+    rates = values(args.rates, float)
+    recording = None
+    if args.input_file:
+        source = FileSource(args.input_file, rate=rates[0], dtype=args.raw_dtype)
+        recording = np.concatenate(list(source.chunks()))
+        # The recording has one rate, benchmarking it once per --rates value would repeat the same configurations
+        if len(rates) > 1:
+            sys.stderr.write("--input_file: using the recording's rate of {:g} Hz, ignoring --rates\n".format(
+                source.rate))
+        rates = [source.rate]
+
+    results = []
+    output = open(args.output, "w") if args.output else sys.stdout
+    try:
+        for rate, window_length, batch_size, features, model_size in itertools.product(
+                rates, values(args.window_lengths, float), values(args.batch_sizes, int),
+                values(args.features, str), values(args.model_sizes, int)):
+            if recording is not None:
+                audio = recording
+            else:
+                audio = synthetic(rate, args.duration, seed=args.seed)
+            try:
+                result = run(audio, rate, window_length, args.hop_length, batch_size, features, args.n_features,
+                             model_size, args.chunk_size, clf=clf, seed=args.seed)
+            except ValueError as e:
+                # A trained model only runs on the features it was trained on
+                sys.stderr.write("rate={:g} window={:g}s batch={} features={} model={}: skipped, {}\n".format(
+                    rate, window_length, batch_size, features, model_size, e))
+                continue
+            results.append(result)
+            output.write(json.dumps(result, sort_keys=True) + "\n")
+            output.flush()
+            sys.stderr.write("rate={:g} window={:g}s batch={} features={} model={}: {:0.0f} windows/s, "
+                             "p99 {:0.3f}ms, memory {:+0.1f}MB\n".format(
+                                 rate, window_length, batch_size, features, model_size, result['windows_per_sec'],
+                                 result.get('window_p99_ms', 0.), result['rss_growth'] / 1e6))
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    if args.baseline:
+        messages = compare(results, args.baseline, args.tolerance)
+        for message in messages:
+            sys.stderr.write(message + "\n")
+        return 1 if messages else 0
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the audio to prediction path of the Smart Sensing System')
+    parser.add_argument('--rates', help='Comma separated sampling rates. With --input_file the first is the rate of a '
+                        'raw or .npy recording, the recording\'s rate is the only one benchmarked', type=str,
+                        default='22050,44100')
+    parser.add_argument('--window_lengths', help='Comma separated window lengths in seconds', type=str,
+                        default='0.05,0.5')
+    parser.add_argument('--hop_length', help='Seconds between overlapping windows, defaults to window_length',
+                        type=float, default=None)
+    parser.add_argument('--batch_sizes', help='Comma separated batch sizes', type=str, default='1')
+    parser.add_argument('--features', help='Comma separated classifier inputs: spectrum, bands, logmel', type=str,
+                        default='spectrum')
+    parser.add_argument('--n_features', help='Number of bands or mel filters', type=int, default=128)
+    parser.add_argument('--model_sizes', help='Comma separated hidden units of the stand-in classifier', type=str,
+                        default='64,512')
+    parser.add_argument('--clf_path', help='Benchmark a trained PKL instead of the stand-in classifier', type=str,
+                        default='')
+    parser.add_argument('--input_file', help='Recording (.wav, .npy or raw) instead of synthetic audio', type=str,
+                        default='')
+    parser.add_argument('--raw_dtype', help='Sample type of raw recordings', type=str, default='int16',
+                        choices=['int16', 'int32', 'float32'])
+    parser.add_argument('--duration', help='Seconds of synthetic audio per configuration', type=float, default=30.)
+    parser.add_argument('--chunk_size', help='Frames per simulated audio callback', type=int, default=1024)
+    parser.add_argument('--seed', help='Seed of the synthetic audio and the stand-in weights', type=int, default=0)
+    parser.add_argument('--output', help='JSON lines file of the results, stdout when empty', type=str, default='')
+    parser.add_argument('--baseline', help='JSON lines output of a previous run to check for regressions', type=str,
+                        default='')
+    parser.add_argument('--tolerance', help='Fraction of the baseline throughput that may be lost', type=float,
+                        default=0.2)
+    sys.exit(main(parser.parse_args()))
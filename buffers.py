@@ -0,0 +1,467 @@
+import os
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
+import numpy as np
+
+
+class RingBuffer(object):
+    """
+    Fixed size circular buffer of audio samples backed by a preallocated NumPy array
+    """
+    def __init__(self, capacity, dtype=np.float32):
+        """
+        Initialize the buffer
+        :param capacity: Number of samples the buffer holds
+        :param dtype: NumPy data type of the samples
+        """
+        self.capacity = int(capacity)
+        # Every sample is stored twice, at index i and i + capacity, so the newest samples are always one contiguous
+        # slice of the array and a window can be handed out as a view without copying
+        self.data = np.zeros(2 * self.capacity, dtype=dtype)
+        # Position where the next sample will be written
+        self.index = 0
+        # Number of valid samples in the buffer
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def full(self):
+        """
+        Check if the buffer holds a complete window
+        :return: boolean: True when capacity samples are stored
+        """
+        return self.size == self.capacity
+
+    def extend(self, samples):
+        """
+        Write samples into the buffer, overwriting the oldest ones when it is full
+        :param samples: Array of samples
+        :return: None
+        """
+        samples = np.asarray(samples, dtype=self.data.dtype).ravel()
+        n = samples.size
+        if n == 0:
+            return
+        if n > self.capacity:
+            # Only the newest capacity samples can survive the write anyway
+            samples = samples[-self.capacity:]
+            n = self.capacity
+
+        i = self.index
+        self.data[i:i + n] = samples
+        if i + n <= self.capacity:
+            self.data[i + self.capacity:i + self.capacity + n] = samples
+        else:
+            split = self.capacity - i
+            self.data[i + self.capacity:] = samples[:split]
+            self.data[:n - split] = samples[split:]
+
+        self.index = (i + n) % self.capacity
+        self.size = min(self.size + n, self.capacity)
+
+    def view(self, n=None):
+        """
+        Contiguous, read-only view of the newest samples in the buffer, oldest first. The view is only valid until
+        the next write, copy it if it has to outlive that
+        :param n: Number of samples to return, defaults to every sample in the buffer
+        :return: NumPy array view
+        """
+        if n is None:
+            n = self.size
+        n = min(int(n), self.size)
+        end = self.index + self.capacity
+        window = self.data[end - n:end]
+        window.flags.writeable = False
+        return window
+
+    def clear(self):
+        """
+        Drop every sample in the buffer
+        :return: None
+        """
+        self.index = 0
+        self.size = 0
+
+
+class AudioHistory(object):
+    """
+    Bounded record of the captured audio: the newest seconds are kept in memory and, optionally, the whole capture is
+    streamed to a raw file on disk that can be read back as a memory map. Every recording gets a file of its own, so
+    captures are never spliced together
+    """
+    def __init__(self, rate, history_length=10., spill_path=None, dtype=np.float32):
+        """
+        Initialize the history
+        :param rate: Sampling rate of the audio
+        :param history_length: Seconds of audio kept in memory
+        :param spill_path: Path of the raw file the whole capture is written to, None to keep only the memory tail.
+        When it exists from an earlier recording, -2, -3, ... is added before the extension
+        :param dtype: NumPy data type of the samples
+        """
+        self.rate = rate
+        self.dtype = np.dtype(dtype)
+        self.tail = RingBuffer(max(int(np.floor(rate * history_length)), 1), dtype=self.dtype)
+        self.spill_path = spill_path
+        self.spill_file = None
+        # File of the current or last recording
+        self.segment_path = None
+        # Total samples recorded, including the ones only left on disk
+        self.count = 0
+
+    def extend(self, samples):
+        """
+        Record a chunk of samples. Costs the same no matter how long the capture has been running
+        :param samples: Array of samples
+        :return: None
+        """
+        samples = np.asarray(samples, dtype=self.dtype).ravel()
+        self.tail.extend(samples)
+        if self.spill_path:
+            if self.spill_file is None:
+                self.segment_path = self.next_segment()
+                # Large buffer so the callback only hits the disk every few hundred chunks
+                self.spill_file = open(self.segment_path, "wb", 1 << 20)
+            self.spill_file.write(samples.tobytes())
+        self.count += samples.size
+
+    def next_segment(self):
+        """
+        Path for a new recording that does not overwrite an earlier one
+        :return: Path
+        """
+        base, extension = os.path.splitext(self.spill_path)
+        path, number = self.spill_path, 1
+        while os.path.exists(path):
+            number += 1
+            path = base + "-" + str(number) + extension
+        return path
+
+    def recent(self, seconds=None):
+        """
+        Newest samples kept in memory
+        :param seconds: Seconds of audio to return, defaults to the whole memory tail
+        :return: NumPy array view, oldest sample first
+        """
+        if seconds is None:
+            return self.tail.view()
+        return self.tail.view(int(np.floor(self.rate * seconds)))
+
+    def load(self):
+        """
+        Memory map the whole current or last recording spilled to disk
+        :return: Read-only NumPy memmap, or None when nothing has been spilled
+        """
+        if not self.segment_path or not os.path.exists(self.segment_path):
+            return None
+        if self.spill_file is not None:
+            self.spill_file.flush()
+        if os.path.getsize(self.segment_path) == 0:
+            return None
+        return np.memmap(self.segment_path, dtype=self.dtype, mode="r")
+
+    def close(self):
+        """
+        Flush and close the spill file. Recording again starts a new file
+        :return: None
+        """
+        if self.spill_file is not None:
+            self.spill_file.close()
+            self.spill_file = None
+
+
+class DropQueue(object):
+    """
+    Bounded FIFO between the audio callback (producer) and the worker that runs the classifier (consumer). Putting
+    never blocks: when the queue is full an item is dropped according to the policy and counted
+    """
+    DROP_OLDEST = "oldest"
+    DROP_NEWEST = "newest"
+
+    def __init__(self, maxsize=64, policy=DROP_OLDEST):
+        """
+        Initialize the queue
+        :param maxsize: Number of items the queue holds before dropping
+        :param policy: "oldest" discards the item waiting the longest, "newest" discards the incoming item
+        """
+        if policy not in (self.DROP_OLDEST, self.DROP_NEWEST):
+            raise ValueError("Unknown drop policy: " + str(policy))
+        self.policy = policy
+        self.items = queue.Queue(maxsize=maxsize)
+        # Number of items thrown away because the consumer could not keep up
+        self.dropped = 0
+
+    def __len__(self):
+        return self.items.qsize()
+
+    def put(self, item):
+        """
+        Add an item without blocking, dropping one if the queue is full
+        :param item: Anything
+        :return: boolean: True if the item was queued
+        """
+        try:
+            self.items.put_nowait(item)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            if self.policy == self.DROP_NEWEST:
+                return False
+        # Make room by discarding the oldest item. The consumer may have emptied a slot in the meantime, which is fine
+        try:
+            self.items.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            self.items.put_nowait(item)
+            return True
+        except queue.Full:
+            return False
+
+    def get(self, timeout=None):
+        """
+        Take the oldest item
+        :param timeout: Seconds to wait for an item, None to wait forever
+        :return: The item, or None if the timeout ran out
+        """
+        try:
+            return self.items.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def clear(self):
+        """
+        Discard every waiting item
+        :return: None
+        """
+        while True:
+            try:
+                self.items.get_nowait()
+            except queue.Empty:
+                return
+
+
+class PlotBuffer(object):
+    """
+    Newest points of a curve, kept in two preallocated ring buffers so adding a point costs the same however many are
+    shown, and the curve can be handed to pyqtgraph as views without building lists
+    """
+    def __init__(self, capacity):
+        """
+        Initialize the buffer
+        :param capacity: Number of points kept
+        """
+        self.xs = RingBuffer(capacity, dtype=np.float64)
+        self.ys = RingBuffer(capacity, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.xs)
+
+    def append(self, x, y):
+        """
+        Add a point, dropping the oldest one when the buffer is full
+        :param x: X value
+        :param y: Y value
+        :return: None
+        """
+        self.xs.extend(x)
+        self.ys.extend(y)
+
+    def x(self):
+        """
+        :return: View of the X values, oldest first
+        """
+        return self.xs.view()
+
+    def y(self):
+        """
+        :return: View of the Y values, oldest first
+        """
+        return self.ys.view()
+
+    def clear(self):
+        """
+        Drop every point
+        :return: None
+        """
+        self.xs.clear()
+        self.ys.clear()
+
+
+class DecimatedSeries(object):
+    """
+    Whole session of a curve with a min/max pyramid on top of it. Level 0 holds every point, each higher level holds
+    the min and max of blocks of factor points of the level below. Drawing a range picks the coarsest level that still
+    has enough points for the screen, so the cost follows the number of pixels and not the number of points
+    """
+    def __init__(self, factor=8, capacity=1024):
+        """
+        Initialize the series
+        :param factor: Number of points of a level reduced to one block of the next level
+        :param capacity: Initial number of points allocated, the arrays double when full
+        """
+        self.factor = int(factor)
+        self.capacity = int(capacity)
+        self.levels = []
+        self.clear()
+
+    def __len__(self):
+        return self.levels[0]['size']
+
+    def new_level(self):
+        level = dict(size=0, x=np.empty(self.capacity), lo=np.empty(self.capacity), hi=np.empty(self.capacity))
+        self.levels.append(level)
+        return level
+
+    def push(self, index, x, lo, hi):
+        """
+        Append a block to a level and, when that completes a block of the level, reduce it into the next level
+        :return: None
+        """
+        level = self.levels[index] if index < len(self.levels) else self.new_level()
+        size = level['size']
+        if size == len(level['x']):
+            for key in ('x', 'lo', 'hi'):
+                level[key] = np.concatenate([level[key], np.empty(size)])
+        level['x'][size] = x
+        level['lo'][size] = lo
+        level['hi'][size] = hi
+        level['size'] = size = size + 1
+        if size % self.factor == 0:
+            start = size - self.factor
+            self.push(index + 1, level['x'][start], level['lo'][start:size].min(), level['hi'][start:size].max())
+
+    def append(self, x, y):
+        """
+        Add a point. X values have to be increasing
+        :param x: X value
+        :param y: Y value
+        :return: None
+        """
+        self.push(0, x, y, y)
+
+    def range(self):
+        """
+        :return: (first X, last X), or None while empty
+        """
+        level = self.levels[0]
+        if level['size'] == 0:
+            return None
+        return level['x'][0], level['x'][level['size'] - 1]
+
+    def span(self, x0, x1, points):
+        """
+        Points and level a query of an X range draws. Two ranges with the same span draw the same curve
+        :param x0: Left edge of the view
+        :param x1: Right edge of the view
+        :param points: Roughly how many points the view can show, e.g. its width in pixels
+        :return: (first point, point after the last, level)
+        """
+        raw = self.levels[0]
+        # One point beyond each edge so the curve runs off the view instead of stopping short
+        start = max(int(np.searchsorted(raw['x'][:raw['size']], x0, side="left")) - 1, 0)
+        stop = min(int(np.searchsorted(raw['x'][:raw['size']], x1, side="right")) + 1, raw['size'])
+        top = 0
+        while top + 1 < len(self.levels) and (stop - start) // self.factor ** top > points:
+            top += 1
+        return start, stop, top
+
+    def query(self, x0, x1, points):
+        """
+        Points to draw for an X range
+        :param x0: Left edge of the view
+        :param x1: Right edge of the view
+        :param points: Roughly how many points the view can show, e.g. its width in pixels
+        :return: (x, y) arrays. Blocks of coarser levels are drawn as their min and max at the block's first X
+        """
+        start, stop, top = self.span(x0, x1, points)
+        if stop <= start:
+            return np.zeros(0), np.zeros(0)
+
+        xs, ys = [], []
+        position = start
+        # Walk down from the coarse level: it covers the range up to its last complete block, every finer level
+        # covers the few points after that
+        for index in range(top, -1, -1):
+            level = self.levels[index]
+            width = self.factor ** index
+            first = position // width
+            last = min(level['size'], -(-stop // width))
+            if last <= first:
+                continue
+            x = level['x'][first:last]
+            if index == 0:
+                xs.append(x)
+                ys.append(level['lo'][first:last])
+            else:
+                xs.append(np.repeat(x, 2))
+                ys.append(np.column_stack([level['lo'][first:last], level['hi'][first:last]]).ravel())
+            position = last * width
+            if position >= stop:
+                break
+        return np.concatenate(xs), np.concatenate(ys)
+
+    def clear(self):
+        """
+        Drop every point
+        :return: None
+        """
+        self.levels = []
+        self.new_level()
+
+
+class DoubleBuffer(object):
+    """
+    Latest value of an array, handed from one writer thread to readers without locks or copies of the whole array.
+    The writer fills the back buffer and publishes it by flipping an index. Readers use take, which reads the values
+    they need from the front buffer and reads again if a publish happened meanwhile, since the writer refills that
+    buffer right after its next publish
+    """
+    def __init__(self, shape, dtype=np.float64):
+        """
+        Initialize both buffers with zeros
+        :param shape: Shape of the array
+        :param dtype: Type of the array
+        """
+        self.buffers = (np.zeros(shape, dtype=dtype), np.zeros(shape, dtype=dtype))
+        self.index = 0
+        # Number of times a new value was published, so readers can tell whether anything changed
+        self.version = 0
+
+    def back(self):
+        """
+        Buffer the writer fills next, only the writer may use it
+        :return: NumPy array
+        """
+        return self.buffers[1 - self.index]
+
+    def publish(self):
+        """
+        Make the filled back buffer the front buffer
+        :return: None
+        """
+        # Flip before counting: a reader that saw the old count re-reads
+        self.index = 1 - self.index
+        self.version += 1
+
+    def front(self):
+        """
+        Latest published value. Read-only, and only consistent until the next publish, use take from other threads
+        :return: NumPy array
+        """
+        return self.buffers[self.index]
+
+    def take(self, indices):
+        """
+        Values of the latest published array at some indices, never a mix of two publishes
+        :param indices: Indices into the array
+        :return: New NumPy array
+        """
+        while True:
+            version = self.version
+            values = np.take(self.buffers[self.index], indices)
+            if self.version == version:
+                return values
@@ -0,0 +1,224 @@
+import datetime
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+
+class HistoryLogger(object):
+    """
+    Sink for the history file. Writes are only collected in memory, a background thread appends them to the file once
+    enough has piled up or a time limit has passed, so logging never blocks the GUI thread on the disk
+    """
+    TEXT = "text"
+    JSON_LINES = "jsonl"
+
+    def __init__(self, path, header="", fmt=TEXT, flush_interval=1., flush_size=1 << 16):
+        """
+        Create the history file and start the writer thread
+        :param path: Path of the history file, truncated when the logger starts
+        :param header: Text written at the top of a text history
+        :param fmt: "text" for the readable history, "jsonl" for one JSON record per event
+        :param flush_interval: Seconds a write may wait in memory
+        :param flush_size: Characters collected before the writer is woken up early
+        """
+        if fmt not in (self.TEXT, self.JSON_LINES):
+            raise ValueError("Unknown history format: " + str(fmt))
+        self.path = path
+        self.fmt = fmt
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+
+        self.pending = []
+        self.pending_size = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+        # Created once here, every later write appends
+        with open(self.path, "w") as f:
+            if self.fmt == self.TEXT:
+                f.write(header)
+
+        self.writer = threading.Thread(target=self.run, name="HistoryLogger")
+        self.writer.daemon = True
+        self.writer.start()
+
+    def write(self, text, event=None, **fields):
+        """
+        Queue an event for the history file. Returns immediately
+        :param text: The event as it appears in a text history
+        :param event: Name of the event in a JSON lines history
+        :param fields: Values of the event in a JSON lines history
+        :return: None
+        """
+        if self.fmt == self.JSON_LINES:
+            fields['event'] = event
+            fields['time'] = time.time()
+            text = json.dumps(fields, sort_keys=True) + "\n"
+        with self.condition:
+            if self.closed:
+                raise ValueError("History logger is closed")
+            self.pending.append(text)
+            self.pending_size += len(text)
+            if self.pending_size >= self.flush_size:
+                self.condition.notify()
+
+    def run(self):
+        """
+        Writer thread: appends whatever has been queued, every flush_interval or when flush_size is reached
+        :return: None
+        """
+        with open(self.path, "a") as f:
+            while True:
+                with self.condition:
+                    if not self.closed and self.pending_size < self.flush_size:
+                        self.condition.wait(self.flush_interval)
+                    batch = self.pending
+                    self.pending = []
+                    self.pending_size = 0
+                    closed = self.closed
+                if batch:
+                    f.write("".join(batch))
+                    f.flush()
+                if closed:
+                    return
+
+    def close(self):
+        """
+        Write everything still queued and stop the writer thread
+        :return: None
+        """
+        with self.condition:
+            if self.closed:
+                return
+            self.closed = True
+            self.condition.notify()
+        self.writer.join()
+
+
+class PredictionStore(object):
+    """
+    Append-only binary store of predictions. Records have a fixed width and are appended to one file per day, so a
+    file can be memory mapped as a record array. The monitors append their batches as they are predicted, which is
+    not in time order, so a time range is found by comparing every timestamp of a file rather than by binary search
+    """
+    RECORD = np.dtype([('time', '<f8'), ('monitor', 'u1'), ('level', 'i1'), ('confidence', '<f4')])
+    MONITORS = {'CTWM': 1, 'WHM': 2}
+    PREFIX = "predictions-"
+    SUFFIX = ".bin"
+
+    def __init__(self, directory):
+        """
+        Open the store, creating the directory if needed
+        :param directory: Directory holding the daily files
+        """
+        self.directory = directory
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self.lock = threading.Lock()
+        self.file = None
+        self.file_day = None
+
+    def path(self, day):
+        """
+        File holding the records of a day
+        :param day: datetime.date
+        :return: Path
+        """
+        return os.path.join(self.directory, self.PREFIX + str(day) + self.SUFFIX)
+
+    def append(self, monitor, levels, confidences=None, times=None):
+        """
+        Append predictions of one monitor
+        :param monitor: Monitor name, "CTWM" or "WHM"
+        :param levels: Predicted classes
+        :param confidences: Confidence of each prediction, NaN when the model has none
+        :param times: Timestamp of each prediction, defaults to now
+        :return: None
+        """
+        levels = np.atleast_1d(levels)
+        records = np.empty(len(levels), dtype=self.RECORD)
+        records['time'] = time.time() if times is None else times
+        records['monitor'] = self.MONITORS[monitor]
+        records['level'] = levels
+        records['confidence'] = np.nan if confidences is None else confidences
+        day = datetime.date.fromtimestamp(records['time'][0])
+        with self.lock:
+            if self.file is None or day != self.file_day:
+                if self.file is not None:
+                    self.file.close()
+                self.file = open(self.path(day), "ab")
+                self.file_day = day
+            self.file.write(records.tobytes())
+            # Readers map the file, so the records have to reach it now
+            self.file.flush()
+
+    def files(self):
+        """
+        Daily files of the store, oldest first
+        :return: List of paths
+        """
+        names = [name for name in os.listdir(self.directory)
+                 if name.startswith(self.PREFIX) and name.endswith(self.SUFFIX)]
+        return [os.path.join(self.directory, name) for name in sorted(names)]
+
+    def load(self, path):
+        """
+        Memory map one daily file
+        :param path: Path of the file
+        :return: Record array, empty if the file has no complete record
+        """
+        count = os.path.getsize(path) // self.RECORD.itemsize
+        if count == 0:
+            return np.zeros(0, dtype=self.RECORD)
+        return np.memmap(path, dtype=self.RECORD, mode="r", shape=(count,))
+
+    def query(self, start=None, end=None, monitor=None):
+        """
+        Records in a time range
+        :param start: Earliest timestamp, None for the beginning
+        :param end: Latest timestamp (exclusive), None for now
+        :param monitor: Only records of this monitor, None for all
+        :return: Record array, oldest first
+        """
+        parts = []
+        for path in self.files():
+            records = self.load(path)
+            if len(records) == 0:
+                continue
+            times = records['time']
+            selected = np.ones(len(records), dtype=bool)
+            if start is not None:
+                selected &= times >= start
+            if end is not None:
+                selected &= times < end
+            if monitor is not None:
+                selected &= records['monitor'] == self.MONITORS[monitor]
+            if selected.any():
+                parts.append(records[selected])
+        if not parts:
+            return np.zeros(0, dtype=self.RECORD)
+        result = np.concatenate(parts)
+        # Stable, so records with the same timestamp keep the order they were appended in
+        return result[np.argsort(result['time'], kind="mergesort")]
+
+    def last(self, seconds, monitor=None):
+        """
+        Records of the last few seconds, e.g. last(2 * 3600, "CTWM") for the last two hours of tool wear
+        :param seconds: Length of the range
+        :param monitor: Only records of this monitor, None for all
+        :return: Record array, oldest first
+        """
+        return self.query(start=time.time() - seconds, monitor=monitor)
+
+    def close(self):
+        """
+        Close the file being appended to
+        :return: None
+        """
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
@@ -0,0 +1,221 @@
+import bisect
+import os
+import threading
+import time
+
+# Monotonic and comparable between threads, time.time on Python 2
+clock = getattr(time, "perf_counter", time.time)
+
+
+class Histogram(object):
+    """
+    Distribution of the durations of one stage, counted in fixed buckets so recording is cheap and the memory does not
+    grow with the run. Each histogram should be recorded from one thread only, threads running the same stage record
+    it under names of their own, e.g. predict_CTWM and predict_WHM
+    """
+    # Upper bounds in seconds, 20 per decade from 1us to 100s, so neighbouring bounds are 12% apart
+    BOUNDS = [10. ** (e / 20.) for e in range(-120, 41)]
+
+    def __init__(self, keep=False):
+        """
+        Initialize the histogram
+        :param keep: Also keep every duration in samples, for offline runs that want exact percentiles
+        """
+        self.samples = [] if keep else None
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.
+        self.min = 0.
+        self.max = 0.
+
+    def record(self, seconds):
+        """
+        Add one duration
+        :param seconds: Duration in seconds
+        :return: None
+        """
+        self.counts[bisect.bisect_left(self.BOUNDS, seconds)] += 1
+        if self.samples is not None:
+            self.samples.append(seconds)
+        if self.count == 0 or seconds < self.min:
+            self.min = seconds
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q):
+        """
+        Estimate of a percentile, interpolated on a log scale inside the bucket holding it
+        :param q: Percentile between 0 and 100
+        :return: Seconds, between the minimum and the maximum, 0 while empty
+        """
+        if self.count == 0:
+            return 0.
+        rank = q / 100. * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                # The recorded extremes are tighter than the bucket bounds for the first and last buckets
+                low = max(self.BOUNDS[index - 1] if index > 0 else self.min, self.min)
+                high = min(self.BOUNDS[index] if index < len(self.BOUNDS) else self.max, self.max)
+                fraction = (rank - (seen - count)) / float(count)
+                if low <= 0.:
+                    return low + (high - low) * fraction
+                return low * (high / low) ** fraction
+        return self.max
+
+    def mean(self):
+        return self.sum / self.count if self.count else 0.
+
+
+class Metrics(object):
+    """
+    Latency histograms of the pipeline stages and counters of the run. The stages record into it as they go, reports
+    and exports are made from another thread at any time
+    """
+    # Stages in the order a window goes through them
+    STAGES = ["callback", "queue", "fft", "batch", "predict", "delivery", "paint"]
+
+    def __init__(self, keep=False):
+        """
+        Initialize the metrics
+        :param keep: Also keep every duration, see Histogram
+        """
+        self.keep = keep
+        self.histograms = dict((stage, Histogram(keep)) for stage in self.STAGES)
+        self.counters = dict()
+        self.watches = dict()
+        self.lock = threading.Lock()
+        self.start = time.time()
+
+    def record(self, stage, seconds):
+        """
+        Add the duration of a stage
+        :param stage: Stage name, new names get their own histogram
+        :param seconds: Duration in seconds
+        :return: None
+        """
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(stage, Histogram(self.keep))
+        histogram.record(seconds)
+
+    def since(self, stage, start):
+        """
+        Add the time since a clock() reading
+        :param stage: Stage name
+        :param start: Value of clock() when the stage started
+        :return: None
+        """
+        self.record(stage, clock() - start)
+
+    def increment(self, name, n=1):
+        """
+        Add to a counter
+        :param name: Counter name
+        :param n: Amount to add
+        :return: None
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def watch(self, name, function):
+        """
+        Report a value kept elsewhere, e.g. the dropped chunks of a DropQueue
+        :param name: Counter name
+        :param function: Called without arguments at every report
+        :return: None
+        """
+        self.watches[name] = function
+
+    def values(self):
+        """
+        Current value of every counter
+        :return: Dictionary
+        """
+        with self.lock:
+            values = dict(self.counters)
+        for name, function in self.watches.items():
+            values[name] = function()
+        return values
+
+    def stages(self):
+        """
+        Stages that recorded something, in pipeline order. Names of the form stage_name follow their stage
+        :return: List of (name, Histogram)
+        """
+        histograms = dict(self.histograms)
+        names = []
+        for stage in self.STAGES:
+            names += [stage] + sorted(name for name in histograms if name.startswith(stage + "_"))
+        names = [name for name in names if name in histograms]
+        names += sorted(set(histograms) - set(names))
+        return [(name, histograms[name]) for name in names if histograms[name].count]
+
+    def summary(self):
+        """
+        Readable report of every stage and counter
+        :return: str
+        """
+        lines = ["Latency after {:0.0f}s (ms):".format(time.time() - self.start)]
+        for name, h in self.stages():
+            lines.append("  {:<12} n={:<8} mean={:0.3f} p50={:0.3f} p90={:0.3f} p99={:0.3f} max={:0.3f}".format(
+                name, h.count, h.mean() * 1000., h.percentile(50) * 1000., h.percentile(90) * 1000.,
+                h.percentile(99) * 1000., h.max * 1000.))
+        values = self.values()
+        if values:
+            lines.append("  " + ", ".join(name + "=" + str(values[name]) for name in sorted(values)))
+        return "\n".join(lines)
+
+    def export(self, path):
+        """
+        Write the metrics to a file: a Prometheus text file, replaced every time, for paths ending in .prom, otherwise
+        one CSV row per stage and counter appended to the file
+        :param path: Path of the file
+        :return: None
+        """
+        if path.endswith(".prom"):
+            self.write_prometheus(path)
+        else:
+            self.write_csv(path)
+
+    def write_prometheus(self, path):
+        lines = []
+        for name, h in self.stages():
+            metric = "sss_" + name + "_seconds"
+            lines.append("# TYPE " + metric + " histogram")
+            seen = 0
+            for index, (bound, count) in enumerate(zip(Histogram.BOUNDS, h.counts)):
+                seen += count
+                # Every fifth bound is enough for dashboards, the cumulative counts stay exact
+                if index % 5 == 0:
+                    lines.append(metric + '_bucket{le="' + repr(bound) + '"} ' + str(seen))
+            lines.append(metric + '_bucket{le="+Inf"} ' + str(h.count))
+            lines.append(metric + "_sum " + repr(h.sum))
+            lines.append(metric + "_count " + str(h.count))
+        for name, value in sorted(self.values().items()):
+            lines.append("# TYPE sss_" + name + " untyped")
+            lines.append("sss_" + name + " " + str(value))
+        # Scrapers must never see a half written file
+        temporary = path + ".tmp"
+        with open(temporary, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        if hasattr(os, "replace"):
+            os.replace(temporary, path)
+        else:
+            os.rename(temporary, path)
+
+    def write_csv(self, path):
+        now = "{:0.3f}".format(time.time())
+        new = not os.path.exists(path)
+        with open(path, "a") as f:
+            if new:
+                f.write("time,name,count,mean,p50,p90,p99,max\n")
+            for name, h in self.stages():
+                f.write(",".join([now, name, str(h.count)] + ["{:0.6f}".format(v) for v in (
+                    h.mean(), h.percentile(50), h.percentile(90), h.percentile(99), h.max)]) + "\n")
+            for name, value in sorted(self.values().items()):
+                f.write(",".join([now, name, str(value), "", "", "", "", ""]) + "\n")
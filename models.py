@@ -0,0 +1,102 @@
+import os
+import threading
+
+
+def load_model(path, mmap_mode=None):
+    """
+    Load a PKL model. scikit-learn is imported here so processes that never load a model do not pay for it
+    :param path: Path of the PKL file
+    :param mmap_mode: joblib mmap_mode, e.g. "r" to memory map the large arrays of an uncompressed model instead of
+    reading them into memory, so processes loading the same file share its pages
+    :return: Classifier
+    """
+    from sklearn.externals import joblib
+    return joblib.load(path, mmap_mode=mmap_mode)
+
+
+class Loading(object):
+    """
+    A model being loaded, or loaded
+    """
+    def __init__(self):
+        self.done = threading.Event()
+        self.model = None
+        self.error = None
+
+
+class ModelRegistry(object):
+    """
+    Loaded models by path and modification time. A file is only loaded once however many monitors use it, and
+    loaded again when it changes on disk. A thread asking for a model another thread is loading waits for it
+    """
+    def __init__(self, mmap_mode="r", loader=load_model):
+        """
+        Initialize the registry
+        :param mmap_mode: joblib mmap_mode models are loaded with
+        :param loader: Function loading a model, called as loader(path, mmap_mode)
+        """
+        self.mmap_mode = mmap_mode
+        self.loader = loader
+        self.lock = threading.Lock()
+        # (absolute path, modification time) to Loading
+        self.models = dict()
+
+    def key(self, path):
+        path = os.path.abspath(path)
+        return path, os.path.getmtime(path)
+
+    def request(self, path):
+        """
+        Entry of a model, and whether the caller has to load it
+        :param path: Path of the PKL file
+        :return: (Loading, bool)
+        """
+        key = self.key(path)
+        with self.lock:
+            loading = self.models.get(key)
+            if loading is not None:
+                return loading, False
+            # An older version of the file is not needed anymore
+            for old in [k for k in self.models if k[0] == key[0]]:
+                del self.models[old]
+            loading = self.models[key] = Loading()
+            return loading, True
+
+    def load(self, path, loading):
+        try:
+            loading.model = self.loader(path, self.mmap_mode)
+        except Exception as e:
+            loading.error = e
+        loading.done.set()
+
+    def get(self, path):
+        """
+        The model of a file, loading it now unless it is already loaded or being loaded in the background
+        :param path: Path of the PKL file
+        :return: Classifier, shared with every other user of the file
+        """
+        loading, new = self.request(path)
+        if new:
+            self.load(path, loading)
+        loading.done.wait()
+        if loading.error is not None:
+            with self.lock:
+                # Let the next call try again
+                if self.models.get(self.key(path)) is loading:
+                    del self.models[self.key(path)]
+            raise loading.error
+        return loading.model
+
+
+# Models shared by everything in this process
+registry = ModelRegistry()
+
+
+def get_model(path):
+    """
+    Shared model of a file
+    :param path: Path of the PKL file
+    :return: Classifier
+    """
+    return registry.get(path)
+
@@ -0,0 +1,207 @@
+import time
+
+import numpy as np
+
+from buffers import RingBuffer
+from metrics import clock
+from spectral import get_plan, make_features
+
+
+class Pipeline(object):
+    """
+    Windowing and spectrum stage shared by every classifier. Audio goes in once, each window's spectrum is computed
+    once and handed to all of the registered monitors. Windows are taken every hop_length seconds, so they overlap
+    when the hop is shorter than the window. Spectra are handed over in batches of up to batch_size rows, a batch is
+    never held back longer than max_latency seconds. With a feature stage the monitors get compact features of the
+    spectrum instead of the spectrum itself
+    """
+    def __init__(self, rate=44100, window_length=0.5, hop_length=None, batch_size=1, max_latency=0.1,
+                 features="spectrum", n_features=128, metrics=None):
+        """
+        Initialize the pipeline
+        :param rate: Sampling rate of the audio
+        :param window_length: Length in seconds of the window the classifiers were trained on
+        :param hop_length: Seconds between the start of consecutive windows, defaults to window_length
+        :param batch_size: Number of spectra collected before the monitors run on them
+        :param max_latency: Seconds the oldest spectrum of a partial batch may wait before the batch is handed over
+        :param features: "spectrum" for the full magnitude spectrum, "bands" or "logmel" for compact features
+        :param n_features: Number of compact features
+        :param metrics: Metrics to record the spectrum and batching times in, None to not record them
+        """
+        self.rate = rate
+        self.window_length = window_length
+        self.count = int(np.floor(self.rate * window_length))
+        if hop_length is None:
+            self.hop = self.count
+        else:
+            self.hop = min(max(int(np.floor(self.rate * hop_length)), 1), self.count)
+        self.audio = RingBuffer(self.count)
+        self.plan = get_plan(self.rate, self.count)
+        self.features = make_features(features, self.plan, n_features)
+        if self.features is not None:
+            # Spectrum of the current window, reduced to features before it goes into the batch
+            self.magnitude = np.empty(self.plan.bins)
+        # Samples received since the last window was processed, and the sequence number of the last chunk
+        self.pending = 0
+        self.sequence = None
+        self.monitors = []
+
+        self.batch_size = max(int(batch_size), 1)
+        self.max_latency = max_latency
+        # Spectra or features are written straight into the rows of this (batch_size, width) matrix
+        width = self.plan.bins if self.features is None else self.features.size
+        self.batch = np.empty((self.batch_size, width))
+        # When the audio of each row's window was captured, valid for the rows handed to the monitors while they run
+        self.times = np.empty(self.batch_size)
+        # Rows of the batch filled so far and when the first of them was filled
+        self.batched = 0
+        self.batch_time = None
+        # Size and waiting time of the last batch handed to the monitors
+        self.last_batch_size = 0
+        self.last_batch_latency = 0.
+        self.metrics = metrics
+
+    def register(self, monitor):
+        """
+        Add a monitor that receives every spectrum
+        :param monitor: Object with a process(spectra) method taking a (windows, bins) array. The array is reused for
+        the next batch, so copy it if it has to outlive the call. The capture times of the windows are in the first
+        rows of times during the call
+        :return: None
+        """
+        if monitor not in self.monitors:
+            self.monitors.append(monitor)
+
+    def unregister(self, monitor):
+        """
+        Stop sending spectra to a monitor
+        :param monitor: A registered monitor
+        :return: None
+        """
+        if monitor in self.monitors:
+            self.monitors.remove(monitor)
+
+    def feed(self, samples, sequence=None, timestamp=None):
+        """
+        Add captured samples, and every hop once a full window is buffered add its spectrum to the batch
+        :param samples: Array of samples
+        :param sequence: Number of the chunk, counted by the producer including the chunks it dropped. When chunks
+        are missing the partial window is discarded, so no window joins audio from before and after the gap
+        :param timestamp: time.time() when the last of the samples was captured, None for now
+        :return: int: Number of spectra handed to the monitors
+        """
+        if sequence is not None:
+            if self.sequence is not None and sequence != self.sequence + 1:
+                self.gap()
+            self.sequence = sequence
+        samples = np.asarray(samples).ravel()
+        delivered = 0
+        start = 0
+        # Split the chunk at window boundaries: the first window ends once the buffer is full, every later one ends
+        # exactly one hop after the previous one
+        while start < samples.size:
+            need = max(self.hop - self.pending, self.count - len(self.audio))
+            stop = min(start + need, samples.size)
+            self.audio.extend(samples[start:stop])
+            self.pending += stop - start
+            start = stop
+            if self.pending >= self.hop and self.audio.full():
+                # The window is a view of the ring buffer and its spectrum goes straight into the batch
+                self.pending = 0
+                # Captured when its last sample was, which is before the end of the chunk
+                end = None if timestamp is None else timestamp - (samples.size - stop) / float(self.rate)
+                delivered += self.add(self.audio.view(), end)
+        return delivered + self.poll()
+
+    def add(self, audio, timestamp=None):
+        """
+        Add the spectrum of a window to the batch, and hand the batch over when it is full
+        :param audio: Array of count samples
+        :param timestamp: time.time() when the last sample of the window was captured, None for now
+        :return: int: Number of spectra handed to the monitors
+        """
+        now = time.time()
+        if self.batched == 0:
+            self.batch_time = now
+        self.times[self.batched] = now if timestamp is None else timestamp
+        start = clock()
+        if self.features is None:
+            self.plan.magnitude(audio, out=self.batch[self.batched])
+        else:
+            self.features.transform(self.plan.magnitude(audio, out=self.magnitude), out=self.batch[self.batched])
+        if self.metrics is not None:
+            self.metrics.since("fft", start)
+        self.batched += 1
+        if self.batched == self.batch_size:
+            return self.flush()
+        return 0
+
+    def poll(self):
+        """
+        Hand over a partial batch whose oldest spectrum has waited for max_latency. Call this regularly when no audio
+        is arriving
+        :return: int: Number of spectra handed to the monitors
+        """
+        if self.batched and time.time() - self.batch_time >= self.max_latency:
+            return self.flush()
+        return 0
+
+    def feature_config(self):
+        """
+        Settings of the feature stage, to compare with the ones a model was trained on
+        :return: Dictionary, or None for the full spectrum
+        """
+        if self.features is None:
+            return None
+        return self.features.config()
+
+    def check_features(self, clf):
+        """
+        Make sure a model was trained on the features this pipeline produces. Models exported by train.py carry their
+        feature settings in features_, models without it were trained on the full spectrum
+        :param clf: Loaded classifier
+        :return: None
+        """
+        expected = getattr(clf, "features_", None)
+        if expected != self.feature_config():
+            raise ValueError("Model was trained on features " + str(expected) + " but the pipeline produces " +
+                             str(self.feature_config()))
+
+    def flush(self):
+        """
+        Run every monitor on the spectra batched so far, in the order they were captured
+        :return: int: Number of spectra handed to the monitors
+        """
+        if not self.batched:
+            return 0
+        spectra = self.batch[:self.batched]
+        self.last_batch_size = self.batched
+        self.last_batch_latency = time.time() - self.batch_time
+        self.batched = 0
+        if self.metrics is not None:
+            self.metrics.record("batch", self.last_batch_latency)
+            self.metrics.increment("windows", self.last_batch_size)
+        for monitor in self.monitors:
+            monitor.process(spectra)
+        return self.last_batch_size
+
+    def gap(self):
+        """
+        Discard the partially filled window because audio is missing after it. The spectra already batched are kept,
+        their windows were complete
+        :return: None
+        """
+        self.audio.clear()
+        self.pending = 0
+        if self.metrics is not None:
+            self.metrics.increment("gaps")
+
+    def reset(self):
+        """
+        Drop the partially filled window and batch
+        :return: None
+        """
+        self.audio.clear()
+        self.pending = 0
+        self.sequence = None
+        self.batched = 0
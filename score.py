@@ -0,0 +1,216 @@
+import argparse
+import csv
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+
+from models import get_model
+from pipeline import Pipeline
+from sources import FileSource, replay
+
+# Models and settings of a worker process, loaded once by init_worker
+worker = dict()
+
+
+class Scorer(object):
+    """
+    Monitor that keeps the predictions of one classifier instead of showing them
+    """
+    def __init__(self, clf):
+        """
+        Initialize the scorer
+        :param clf: Loaded classifier
+        """
+        self.clf = clf
+        self.predictions = []
+
+    def process(self, spectra):
+        """
+        Predict a batch of windows
+        :param spectra: (windows, bins) array of magnitude spectra
+        :return: None
+        """
+        self.predictions.append(np.asarray(self.clf.predict(spectra)))
+
+    def result(self):
+        """
+        All predictions so far, oldest window first
+        :return: NumPy array
+        """
+        if not self.predictions:
+            return np.zeros(0, dtype=np.int16)
+        return np.concatenate(self.predictions).astype(np.int16)
+
+
+def find_recordings(input_dir, extensions):
+    """
+    List the recordings in a directory and its subdirectories
+    :param input_dir: Directory to search
+    :param extensions: File extensions to include, without the dot
+    :return: Sorted list of paths
+    """
+    extensions = tuple("." + e.lower().lstrip(".") for e in extensions)
+    paths = []
+    for root, _, files in os.walk(input_dir):
+        for name in files:
+            if name.lower().endswith(extensions):
+                paths.append(os.path.join(root, name))
+    return sorted(paths)
+
+
+def init_worker(clf_paths, settings):
+    """
+    Load the models once per worker process, memory mapped so the workers share their pages
+    :param clf_paths: Dictionary of monitor name to PKL path
+    :param settings: Dictionary of pipeline and source settings
+    :return: None
+    """
+    worker['clfs'] = [(name, get_model(path)) for name, path in sorted(clf_paths.items())]
+    worker['settings'] = settings
+
+
+def score_file(path):
+    """
+    Run every model over one recording
+    :param path: Path of the recording
+    :return: (path, window end times in seconds, dictionary of monitor name to predictions, error message or None)
+    """
+    settings = worker['settings']
+    try:
+        source = FileSource(path, rate=settings['rate'], dtype=settings['raw_dtype'],
+                            chunk_size=settings['chunk_size'])
+        pipeline = Pipeline(rate=source.rate, window_length=settings['window_length'],
+                            hop_length=settings['hop_length'], batch_size=settings['batch_size'],
+                            max_latency=float('inf'), features=settings['features'],
+                            n_features=settings['n_features'])
+        scorers = dict()
+        for name, clf in worker['clfs']:
+            pipeline.check_features(clf)
+            scorers[name] = Scorer(clf)
+            pipeline.register(scorers[name])
+        windows = replay(source, pipeline)
+    except Exception as e:
+        return path, None, None, str(e)
+    # Window k ends one window plus k hops into the recording
+    times = (pipeline.count + np.arange(windows) * pipeline.hop) / float(source.rate)
+    return path, times, dict((name, scorer.result()) for name, scorer in scorers.items()), None
+
+
+def write_output(output, paths, columns, names):
+    """
+    Write the per-window predictions of every recording to one file, format chosen by the extension
+    :param output: Path ending in .csv, .npz or .parquet
+    :param paths: Recordings, in the order of their index
+    :param columns: Dictionary of column name to array, with one row per window. The recording column indexes paths
+    :param names: Prediction column names
+    :return: None
+    """
+    extension = os.path.splitext(output)[1].lower()
+    if extension == ".npz":
+        np.savez_compressed(output, paths=np.array(paths), **columns)
+    elif extension == ".parquet":
+        try:
+            import pandas as pd
+        except ImportError:
+            raise ImportError("Writing Parquet needs pandas and pyarrow, use .csv or .npz instead")
+        frame = pd.DataFrame(columns)
+        frame['recording'] = pd.Categorical.from_codes(columns['recording'], categories=paths)
+        frame.to_parquet(output, index=False)
+    else:
+        # The csv module writes its own line endings, text mode would turn them into blank rows on Windows
+        if sys.version_info[0] < 3:
+            f = open(output, "wb")
+        else:
+            f = open(output, "w", newline="")
+        with f:
+            writer = csv.writer(f)
+            writer.writerow(['recording', 'window', 'time'] + names)
+            for row in range(len(columns['recording'])):
+                writer.writerow([paths[columns['recording'][row]], columns['window'][row], '{:0.4f}'.format(
+                    columns['time'][row])] + [columns[name][row] for name in names])
+
+
+def main(args):
+    """
+    Score every recording in a directory with a pool of worker processes
+    :param args: Parsed command line arguments
+    :return: int: Exit code
+    """
+    clf_paths = dict()
+    if args.clf_path_CTWM:
+        clf_paths['CTWM'] = args.clf_path_CTWM
+    if args.clf_path_WHM:
+        clf_paths['WHM'] = args.clf_path_WHM
+    if not clf_paths:
+        print("Give at least one of --clf_path_CTWM and --clf_path_WHM")
+        return 1
+    names = sorted(clf_paths)
+
+    paths = find_recordings(args.input_dir, args.extensions.split(","))
+    if not paths:
+        print("No recordings found in " + args.input_dir)
+        return 1
+
+    settings = dict(rate=args.rate, raw_dtype=args.raw_dtype, chunk_size=args.chunk_size,
+                    window_length=args.window_length, hop_length=args.hop_length, batch_size=args.batch_size,
+                    features=args.features, n_features=args.n_features)
+    start = time.time()
+    pool = multiprocessing.Pool(args.workers or None, initializer=init_worker, initargs=(clf_paths, settings))
+    files, windows, times = [], [], []
+    predictions = dict((name, []) for name in names)
+    failed = 0
+    try:
+        # imap keeps the results in the order of paths while the workers run ahead
+        for index, (path, file_times, file_predictions, error) in enumerate(pool.imap(score_file, paths)):
+            if error is not None:
+                failed += 1
+                print("Skipped " + path + ": " + error)
+                continue
+            files.append(np.full(len(file_times), index, dtype=np.int32))
+            windows.append(np.arange(len(file_times), dtype=np.int32))
+            times.append(file_times)
+            for name in names:
+                predictions[name].append(file_predictions[name])
+            print("Scored " + path + " (" + str(len(file_times)) + " windows)")
+    finally:
+        pool.close()
+        pool.join()
+
+    def join(arrays, dtype):
+        return np.concatenate(arrays) if arrays else np.zeros(0, dtype=dtype)
+
+    columns = dict(recording=join(files, np.int32), window=join(windows, np.int32), time=join(times, np.float64))
+    for name in names:
+        columns[name] = join(predictions[name], np.int16)
+    write_output(args.output, paths, columns, names)
+    print("Scored " + str(len(paths) - failed) + " of " + str(len(paths)) + " recordings, " +
+          str(len(columns['recording'])) + " windows in {:0.1f}s".format(time.time() - start))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Score recordings with the Smart Sensing System models')
+    parser.add_argument("input_dir", help='Directory of recordings', type=str)
+    parser.add_argument("--clf_path_CTWM", help='Classifier path', type=str, default='')
+    parser.add_argument("--clf_path_WHM", help='Classifier path', type=str, default='')
+    parser.add_argument("--output", help='Predictions file, .csv, .npz or .parquet', type=str,
+                        default='predictions.csv')
+    parser.add_argument('--window_length', help='Window length used to train Algorithm', type=float, default=0.5)
+    parser.add_argument('--hop_length', help='Seconds between overlapping windows, defaults to window_length',
+                        type=float, default=None)
+    parser.add_argument('--features', help='Classifier input, must match the one the models were trained on',
+                        type=str, choices=['spectrum', 'bands', 'logmel'], default='spectrum')
+    parser.add_argument('--n_features', help='Number of bands or mel filters', type=int, default=128)
+    parser.add_argument('--rate', help='Sampling rate of .npy and raw recordings', type=float, default=44100)
+    parser.add_argument('--raw_dtype', help='Sample type of raw recordings', type=str, default='int16',
+                        choices=['int16', 'int32', 'float32'])
+    parser.add_argument('--extensions', help='Comma separated extensions of the recordings', type=str,
+                        default='wav,npy,raw')
+    parser.add_argument('--workers', help='Worker processes, defaults to one per core', type=int, default=0)
+    parser.add_argument('--batch_size', help='Windows predicted together in one classifier call', type=int,
+                        default=64)
+    parser.add_argument('--chunk_size', help='Frames read from a recording at a time', type=int, default=65536)
+    sys.exit(main(parser.parse_args()))
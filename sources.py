@@ -0,0 +1,155 @@
+import os
+import struct
+import time
+
+import numpy as np
+
+
+# WAV format tags
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+def read_wav_header(path):
+    """
+    Find the format and the position of the samples in a WAV file, so they can be memory mapped instead of read
+    :param path: Path of the WAV file
+    :return: (rate, channels, dtype, offset, frames)
+    """
+    with open(path, "rb") as f:
+        riff, _, wave_id = struct.unpack("<4sI4s", f.read(12))
+        if riff != b"RIFF" or wave_id != b"WAVE":
+            raise ValueError("Not a WAV file: " + path)
+        fmt = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError("No data chunk in WAV file: " + path)
+            chunk_id, size = struct.unpack("<4sI", header)
+            if chunk_id == b"fmt ":
+                fmt = f.read(size)
+                if size % 2:
+                    f.seek(1, os.SEEK_CUR)
+            elif chunk_id == b"data":
+                offset = f.tell()
+                break
+            else:
+                # Chunks are padded to an even size
+                f.seek(size + size % 2, os.SEEK_CUR)
+        if fmt is None:
+            raise ValueError("No fmt chunk in WAV file: " + path)
+
+    tag, channels, rate, _, block_align, bits = struct.unpack("<HHIIHH", fmt[:16])
+    if tag == WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+        # The real format tag is the first two bytes of the sub format GUID
+        tag = struct.unpack("<H", fmt[24:26])[0]
+    if tag == WAVE_FORMAT_PCM and bits in (8, 16, 32):
+        dtype = {8: np.uint8, 16: np.int16, 32: np.int32}[bits]
+    elif tag == WAVE_FORMAT_IEEE_FLOAT and bits in (32, 64):
+        dtype = {32: np.float32, 64: np.float64}[bits]
+    else:
+        raise ValueError("Unsupported WAV format (tag " + str(tag) + ", " + str(bits) + " bits): " + path)
+    # A truncated recording can claim more data than the file holds
+    size = min(size, os.path.getsize(path) - offset)
+    frames = size // block_align
+    return rate, channels, np.dtype(dtype).newbyteorder("<"), offset, frames
+
+
+def to_float32(samples):
+    """
+    Convert samples to float32 in [-1, 1], the format the live stream is captured in
+    :param samples: Array of samples of any supported dtype
+    :return: float32 NumPy array
+    """
+    if samples.dtype.kind == "f":
+        return samples.astype(np.float32)
+    if samples.dtype.kind == "u":
+        # 8 bit WAV is unsigned with the zero at 128
+        half = float(2 ** (8 * samples.dtype.itemsize - 1))
+        return ((samples.astype(np.float32) - half) / half).astype(np.float32)
+    return (samples.astype(np.float32) / float(2 ** (8 * samples.dtype.itemsize - 1))).astype(np.float32)
+
+
+class FileSource(object):
+    """
+    Recorded audio read in chunks from a memory mapped file, as a replacement for the live PyAudio stream. Supports WAV,
+    NumPy .npy and headerless raw files
+    """
+    def __init__(self, path, rate=None, dtype=np.int16, channels=1, chunk_size=4096):
+        """
+        Open the recording
+        :param path: Path of a .wav, .npy or raw file
+        :param rate: Sampling rate of .npy and raw files. WAV files carry their own
+        :param dtype: Sample type of raw files, e.g. int16 or float32
+        :param channels: Number of interleaved channels of .npy and raw files
+        :param chunk_size: Number of frames yielded at a time
+        """
+        self.path = path
+        self.chunk_size = int(chunk_size)
+        extension = os.path.splitext(path)[1].lower()
+        if extension == ".wav":
+            self.rate, self.channels, sample_dtype, offset, frames = read_wav_header(path)
+            self.samples = np.memmap(path, dtype=sample_dtype, mode="r", offset=offset,
+                                     shape=(frames, self.channels))
+        elif extension == ".npy":
+            self.rate = rate
+            self.samples = np.load(path, mmap_mode="r")
+            if self.samples.ndim == 1:
+                self.samples = self.samples.reshape(-1, 1)
+            self.channels = self.samples.shape[1]
+        else:
+            self.rate = rate
+            self.channels = channels
+            sample_dtype = np.dtype(dtype)
+            frames = os.path.getsize(path) // (sample_dtype.itemsize * channels)
+            self.samples = np.memmap(path, dtype=sample_dtype, mode="r", shape=(frames, channels))
+        if self.rate is None:
+            raise ValueError("Sampling rate of " + path + " is unknown, pass rate")
+        self.frames = self.samples.shape[0]
+
+    def duration(self):
+        """
+        Length of the recording
+        :return: float: seconds
+        """
+        return self.frames / float(self.rate)
+
+    def chunks(self):
+        """
+        Read the recording one chunk at a time, only the chunk being converted is paged in
+        :return: Generator of mono float32 arrays
+        """
+        for start in range(0, self.frames, self.chunk_size):
+            block = to_float32(self.samples[start:start + self.chunk_size])
+            if self.channels > 1:
+                block = block.mean(axis=1)
+            yield block.ravel()
+
+
+def replay(source, pipeline, speed=0., running=None):
+    """
+    Feed a recording through a pipeline, flushing the last partial batch at the end
+    :param source: FileSource to read
+    :param pipeline: Pipeline with the monitors registered
+    :param speed: Playback speed relative to real time, 0 runs as fast as possible
+    :param running: Function returning False to stop early, None to replay the whole file
+    :return: int: Number of spectra handed to the monitors
+    """
+    if source.rate != pipeline.rate:
+        raise ValueError("Recording is sampled at " + str(source.rate) + " Hz, the pipeline expects " +
+                         str(pipeline.rate) + " Hz")
+    delivered = 0
+    start_time = time.time()
+    position = 0
+    for chunk in source.chunks():
+        if running is not None and not running():
+            return delivered
+        delivered += pipeline.feed(chunk)
+        position += chunk.size
+        if speed > 0:
+            # Sleep until the wall clock catches up with the recording
+            wait = position / (float(source.rate) * speed) - (time.time() - start_time)
+            if wait > 0:
+                time.sleep(wait)
+    return delivered + pipeline.flush()
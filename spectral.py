@@ -0,0 +1,210 @@
+import numpy as np
+
+
+class SpectrumPlan(object):
+    """
+    Everything about the spectrum of a window that only depends on the sampling rate and the window size: the
+    frequency of each bin, the bins of target frequencies and the output buffer. Get one with get_plan so each
+    (rate, size) pair is only set up once
+    """
+    def __init__(self, rate, size):
+        """
+        Initialize the plan
+        :param rate: Sampling rate of the audio
+        :param size: Number of samples in a window
+        """
+        self.rate = rate
+        self.size = int(size)
+        # Real input, so only the non-negative half of the spectrum is computed
+        self.freq = np.fft.rfftfreq(self.size, 1.0 / self.rate)
+        self.bins = len(self.freq)
+        self.out = np.empty(self.bins)
+        self.targets = dict()
+
+    def bin(self, target):
+        """
+        Index of the first bin at or above a frequency
+        :param target: Frequency in Hz
+        :return: int
+        """
+        index = self.targets.get(target)
+        if index is None:
+            if target > self.freq[-1]:
+                raise ValueError("Target " + str(target) + " Hz is above the spectrum, increase chunk size")
+            index = int(np.searchsorted(self.freq, target, side="left"))
+            self.targets[target] = index
+        return index
+
+    def transform(self, audio):
+        """
+        Complex spectrum of a window
+        :param audio: Array of size samples
+        :return: Complex NumPy array of bins values
+        """
+        return np.fft.rfft(audio, n=self.size)
+
+    def magnitude(self, audio, out=None):
+        """
+        Magnitude spectrum of a window, written into a reused buffer
+        :param audio: Array of size samples
+        :param out: Array of bins values to write into, defaults to the plan's own buffer, which the next call
+        overwrites
+        :return: out
+        """
+        if out is None:
+            out = self.out
+        return np.abs(self.transform(audio), out=out)
+
+
+# Plans already set up, by (rate, size)
+plans = dict()
+
+
+def get_plan(rate, size):
+    """
+    Shared plan for a sampling rate and window size
+    :param rate: Sampling rate of the audio
+    :param size: Number of samples in a window
+    :return: SpectrumPlan
+    """
+    key = (float(rate), int(size))
+    plan = plans.get(key)
+    if plan is None:
+        plan = plans[key] = SpectrumPlan(rate, size)
+    return plan
+
+
+class BandEnergies(object):
+    """
+    Compact features: the log energy of the spectrum in equally wide frequency bands
+    """
+    kind = "bands"
+
+    def __init__(self, plan, size=128, fmin=0., fmax=None):
+        """
+        Initialize the bands
+        :param plan: SpectrumPlan of the windows
+        :param size: Number of bands
+        :param fmin: Lowest frequency in Hz
+        :param fmax: Highest frequency in Hz, defaults to half the sampling rate
+        """
+        self.plan = plan
+        self.size = int(size)
+        self.fmin = float(fmin)
+        self.fmax = float(plan.rate / 2. if fmax is None else fmax)
+        low = int(np.searchsorted(plan.freq, self.fmin, side="left"))
+        self.high = int(np.searchsorted(plan.freq, self.fmax, side="right"))
+        if self.high - low < self.size:
+            raise ValueError("Only " + str(self.high - low) + " bins between " + str(self.fmin) + " and " +
+                             str(self.fmax) + " Hz, use fewer bands or a longer window")
+        # First bin of every band, each band ends where the next one starts and the last one at high
+        self.edges = np.linspace(low, self.high, self.size + 1).astype(np.intp)[:-1]
+
+    def transform(self, magnitude, out=None):
+        """
+        Features of one or more windows
+        :param magnitude: Magnitude spectrum, (bins,) or (windows, bins)
+        :param out: Array to write the features into
+        :return: (size,) or (windows, size) array
+        """
+        power = np.square(magnitude[..., :self.high])
+        out = np.add.reduceat(power, self.edges, axis=-1, out=out)
+        return np.log10(np.maximum(out, 1e-12, out=out), out=out)
+
+    def config(self):
+        """
+        Settings a model trained on these features has to be used with
+        :return: Dictionary
+        """
+        return dict(kind=self.kind, size=self.size, fmin=self.fmin, fmax=self.fmax, rate=float(self.plan.rate),
+                    window=self.plan.size)
+
+
+class LogMel(object):
+    """
+    Compact features: the log energy of the spectrum through a bank of triangular filters spaced on the mel scale
+    """
+    kind = "logmel"
+
+    def __init__(self, plan, size=64, fmin=0., fmax=None):
+        """
+        Initialize the filter bank
+        :param plan: SpectrumPlan of the windows
+        :param size: Number of mel filters
+        :param fmin: Lowest frequency in Hz
+        :param fmax: Highest frequency in Hz, defaults to half the sampling rate
+        """
+        self.plan = plan
+        self.size = int(size)
+        self.fmin = float(fmin)
+        self.fmax = float(plan.rate / 2. if fmax is None else fmax)
+        if self.size < 1:
+            raise ValueError("Need at least one mel filter, got " + str(self.size))
+        if not 0. <= self.fmin < self.fmax <= plan.rate / 2.:
+            raise ValueError("Mel filters need 0 <= fmin < fmax <= " + str(plan.rate / 2.) + " Hz, got " +
+                             str(self.fmin) + " and " + str(self.fmax) + " Hz")
+        # Filter edges equally spaced in mel, converted back to Hz
+        mels = np.linspace(self.hz_to_mel(self.fmin), self.hz_to_mel(self.fmax), self.size + 2)
+        hz = self.mel_to_hz(mels)
+        lower, center, upper = hz[:-2, np.newaxis], hz[1:-1, np.newaxis], hz[2:, np.newaxis]
+        rising = (plan.freq - lower) / (center - lower)
+        falling = (upper - plan.freq) / (upper - center)
+        # (bins, size) so a window's power spectrum times the bank gives its features in one product
+        self.bank = np.ascontiguousarray(np.maximum(0., np.minimum(rising, falling)).T)
+        # A filter narrower than the bin spacing would be a constant feature
+        empty = np.nonzero(~self.bank.any(axis=0))[0]
+        if empty.size:
+            raise ValueError(str(empty.size) + " of " + str(self.size) + " mel filters between " + str(self.fmin) +
+                             " and " + str(self.fmax) + " Hz cover no bin, use fewer filters or a longer window")
+        # Only the bins some filter covers take part in the product
+        used = np.nonzero(self.bank.any(axis=1))[0]
+        self.low, self.high = int(used[0]), int(used[-1]) + 1
+        self.bank = self.bank[self.low:self.high]
+
+    @staticmethod
+    def hz_to_mel(hz):
+        return 2595. * np.log10(1. + np.asarray(hz) / 700.)
+
+    @staticmethod
+    def mel_to_hz(mel):
+        return 700. * (10. ** (np.asarray(mel) / 2595.) - 1.)
+
+    def transform(self, magnitude, out=None):
+        """
+        Features of one or more windows
+        :param magnitude: Magnitude spectrum, (bins,) or (windows, bins)
+        :param out: Array to write the features into
+        :return: (size,) or (windows, size) array
+        """
+        power = np.square(magnitude[..., self.low:self.high])
+        out = np.dot(power, self.bank, out=out)
+        return np.log10(np.maximum(out, 1e-12, out=out), out=out)
+
+    def config(self):
+        """
+        Settings a model trained on these features has to be used with
+        :return: Dictionary
+        """
+        return dict(kind=self.kind, size=self.size, fmin=self.fmin, fmax=self.fmax, rate=float(self.plan.rate),
+                    window=self.plan.size)
+
+
+# Feature stages that can be picked by name, "spectrum" feeds the full magnitude spectrum to the models
+FEATURES = {BandEnergies.kind: BandEnergies, LogMel.kind: LogMel}
+
+
+def make_features(kind, plan, size, fmin=0., fmax=None):
+    """
+    Create a feature stage by name
+    :param kind: "spectrum", "bands" or "logmel"
+    :param plan: SpectrumPlan of the windows
+    :param size: Number of features
+    :param fmin: Lowest frequency in Hz
+    :param fmax: Highest frequency in Hz, defaults to half the sampling rate
+    :return: Feature stage, or None for the full spectrum
+    """
+    if kind in (None, "", "spectrum"):
+        return None
+    if kind not in FEATURES:
+        raise ValueError("Unknown features: " + str(kind))
+    return FEATURES[kind](plan, size=size, fmin=fmin, fmax=fmax)
@@ -0,0 +1,80 @@
+import importlib
+import threading
+import time
+
+
+class StartupReport(object):
+    """
+    Time from the start of the process to each step of start up, to see what the operator is waiting for
+    """
+    def __init__(self):
+        self.start = time.time()
+        self.steps = []
+        self.lock = threading.Lock()
+
+    def mark(self, step):
+        """
+        Record that a step has finished
+        :param step: Name of the step
+        :return: None
+        """
+        with self.lock:
+            self.steps.append((step, time.time() - self.start, threading.current_thread().name))
+
+    def summary(self):
+        """
+        Readable report of the steps, in the order they finished
+        :return: str
+        """
+        lines = ["Start up (ms since the process started):"]
+        with self.lock:
+            steps = sorted(self.steps, key=lambda step: step[1])
+        for step, elapsed, thread in steps:
+            lines.append("  {:8.1f}  {:<32} {}".format(elapsed * 1000., step, thread))
+        return "\n".join(lines)
+
+
+# Started by the first import, so import it before anything heavy
+report = StartupReport()
+
+
+class LazyModule(object):
+    """
+    Stands in for a module that is only imported when one of its attributes is first used, or when load is called,
+    e.g. from a background thread
+    """
+    def __init__(self, name):
+        self.name = name
+        self.module = None
+
+    def load(self):
+        """
+        Import the module now
+        :return: The module
+        """
+        if self.module is None:
+            self.module = importlib.import_module(self.name)
+        return self.module
+
+    def __getattr__(self, attribute):
+        return getattr(self.load(), attribute)
+
+
+def in_background(steps):
+    """
+    Run start up steps one after the other in a daemon thread, recording each in the report. A step that fails is
+    reported, the error shows up again where its result is used
+    :param steps: List of (name, function)
+    :return: threading.Thread
+    """
+    def run():
+        for step, function in steps:
+            try:
+                function()
+                report.mark(step)
+            except Exception as e:
+                report.mark(step + " failed: " + str(e))
+    thread = threading.Thread(target=run, name="Startup")
+    thread.daemon = True
+    thread.start()
+    return thread
@@ -1,27 +1,41 @@
+from startup import LazyModule, in_background, report
 import argparse
+import collections
 import os
 import time
-from collections import deque
-import math
-import pyaudio
-from PyQt5.QtCore import QThread, pyqtSignal, QTimer, pyqtSlot, QElapsedTimer
-import pyqtgraph as pg
+from PyQt5.QtCore import QObject, QThread, pyqtSignal, QTimer, pyqtSlot, QElapsedTimer
 from PyQt5 import QtWidgets
 import numpy as np
 import sys
 from PyQt5.QtGui import QPixmap, QIcon
-from sklearn.externals import joblib
 import ctypes
-from pyqtgraph.Qt import QtGui, QtCore
+from PyQt5 import QtGui, QtCore
 from PyQt5.QtWidgets import (QApplication, QComboBox, QDialog, QDialogButtonBox, QFormLayout, QGroupBox, QHBoxLayout,
                              QLabel, QVBoxLayout, QCheckBox, QDoubleSpinBox)
 from datetime import datetime
+from buffers import AudioHistory, DecimatedSeries, DropQueue, PlotBuffer
+from pipeline import Pipeline
+from sources import FileSource, replay
+from history import HistoryLogger, PredictionStore
+from metrics import Metrics, clock
+from models import get_model
+from toollife import WhatIfEngine, cutting_speed, tool_life
+from workers import InferencePool, predicted_probability
+
+# Only needed once the main window opens, imported in the background while the settings dialog is open
+pg = LazyModule("pyqtgraph")
+pyaudio = LazyModule("pyaudio")
+report.mark("imports")
 
 class UI(QtWidgets.QMainWindow):
     """
         Class to create the GUI, the front-end of this project
     """
-    def __init__(self, showCTWM, showWHM, showRTLE, algorithmCTWM, algorithmWHM, tool_type_text, material_text,
+    # Seconds between two remaining tool life estimates written to the history
+    RTLE_LOG_INTERVAL = 10.
+
+    def __init__(self, showCTWM, showWHM, showRTLE, captureEngine, algorithmCTWM, algorithmWHM, tool_type_text,
+                 material_text,
                  flutes_text, coating_text, cutting_type_text, wpmaterial_text, heat_text, tool_diameter_num,
                  parent_img_path=None):
         """
@@ -29,8 +43,9 @@ class UI(QtWidgets.QMainWindow):
         :param showCTWM: boolean: Show the Cutting Tool Wear Monitoring (CTWM)
         :param showWHM: boolean: Show the Workpiece Hardness Monitoring (WHM)
         :param showRTLE: boolean: Show the Remaining Tool Life Estimation (RTLE)
-        :param algorithmCTWM: Thread that run the algorithm for CTWM
-        :param algorithmWHM: Thread that runs the algorithm for WHM
+        :param captureEngine: Thread that captures the audio and runs the algorithms
+        :param algorithmCTWM: Algorithm for CTWM
+        :param algorithmWHM: Algorithm for WHM
         :param parent_img_path: Path of where the images to display are
         """
 
@@ -80,17 +95,20 @@ class UI(QtWidgets.QMainWindow):
 
         # Initialize file to save output to
         self.save_file_name = "HTW" + str(datetime.now().date())
-        self.save_file = open(os.path.join(args.parent_img_path, self.save_file_name), "w")
-        self.save_file.write("History of Tool Wear" + "\n")
-        self.save_file.close()
+        # Written in the background so logging never blocks the GUI
+        self.history = HistoryLogger(os.path.join(args.parent_img_path, self.save_file_name),
+                                     header="History of Tool Wear" + "\n", fmt=args.history_format)
+
 
+        # The thread that captures audio for every algorithm
+        self.captureEngine = captureEngine
 
-        # Assigns the thread that runs the algorithm to the flag setPointsCTWM
+        # Assigns the algorithm to the flag setPointsCTWM
         self.setPointsCTWM = algorithmCTWM
         # When the algorithm raises the flag 'finished', do the function "updateCTWM"
         self.setPointsCTWM.finished.connect(self.updateCTWM)
 
-        # Assigns the thread that runs the algorithm to the flag setPointsWHM
+        # Assigns the algorithm to the flag setPointsWHM
         self.setPointsWHM = algorithmWHM
         # When the algorithm raises the flag 'finished', do the function "updateWHM"
         self.setPointsWHM.finished.connect(self.updateWHM)
@@ -154,10 +172,23 @@ class UI(QtWidgets.QMainWindow):
         # Set up pen to be used to draw the graphs
         self.pen = pg.mkPen(color='b', width=3)
 
-        # Use a numpy array to keep track of the outcomes of the wear condition
-        self.outcomesCTWM = np.array([])
-        # Use a numpy array to keep track of the outcomes of the hardness condition
-        self.outcomesWHM = np.array([])
+        # Latest outcome of the wear condition, the whole history is kept in the prediction store
+        self.lastCTWM = None
+        # Latest outcome of the hardness condition
+        self.lastWHM = None
+        # Level the images currently show, and whether anything changed since the last frame
+        self.shownCTWM = None
+        self.shownWHM = None
+        self.dirtyCTWM = False
+        self.dirtyWHM = False
+        # (first point, point after the last, level) each DecimatedSeries was last drawn with
+        self.drawnSpans = dict()
+        # Tool life of the entered parameters once Compute is pressed, and the wear level the RTLE widget shows
+        self.toolLife = None
+        self.shownRTLE = None
+        # Wear level of the last estimate written to the history, and clock() when it was written
+        self.loggedRTLE = None
+        self.loggedRTLETime = None
 
         if self.showCTWM: # Show the Cutting Tool Wear Monitoring widget
             self.initCTWM()
@@ -186,8 +217,23 @@ class UI(QtWidgets.QMainWindow):
         self.fourthRow.addWidget(self.version)
         self.mainLayout.addLayout(self.fourthRow)
 
+        # Repaint at a fixed frame rate, however fast the predictions arrive
+        self.renderTimer = QTimer()
+        self.renderTimer.timeout.connect(self.renderFrame)
+        self.renderTimer.start(int(1000 / max(args.fps, 1.)))
+
+        # Periodic latency report of the whole pipeline
+        self.metrics = self.captureEngine.metrics
+        self.metricsTimer = QTimer()
+        self.metricsTimer.timeout.connect(self.reportMetrics)
+        if args.metrics_interval > 0:
+            self.metricsTimer.start(int(args.metrics_interval * 1000))
+
         # Show all these widgets
         self.show()
+        report.mark("main window")
+        if args.startup_report:
+            print(report.summary())
 
         ##############################################################################################################
         #                                                                                                             #
@@ -199,11 +245,7 @@ class UI(QtWidgets.QMainWindow):
         Starts the algorithm when Start button is pressed
         :return: None
         """
-        self.showtime = time.time()
-
-        self.save_file = open(os.path.join(args.parent_img_path, self.save_file_name), "a")
-        self.save_file.write("\nStart Button Pressed\n")
-        self.save_file.close()
+        self.history.write("\nStart Button Pressed\n", event="start")
 
         # Timers for x axis scrolling.
         self.tmr = QElapsedTimer()
@@ -213,11 +255,7 @@ class UI(QtWidgets.QMainWindow):
         self.startButton.setEnabled(False)
         self.stopButton.setEnabled(True)
         self.reset.setEnabled(False)
-        if self.showCTWM:
-            self.setPointsCTWM.start()  # starts the algorithm
-        if self.showWHM:
-            time.sleep(0.1)
-            self.setPointsWHM.start()
+        self.captureEngine.start()  # starts the algorithms
 
     def stopButtonPressed(self):
         """
@@ -227,22 +265,45 @@ class UI(QtWidgets.QMainWindow):
 
         self.booleanStartButtonPressed = False  # For RTLE's updateLabel function to check
 
-        self.save_file = open(os.path.join(args.parent_img_path, self.save_file_name), "a")
-        self.save_file.write("\nStop Button Pressed\n")
-        self.save_file.close()
+        self.history.write("\nStop Button Pressed\n", event="stop")
 
         print("Stop button has been pressed!")
 
         self.stopButton.setEnabled(False)
         self.startButton.setEnabled(True)
         self.reset.setEnabled(True)
-        if self.showCTWM:
-            self.setPointsCTWM.stopit() # stops the algorithm
-        if self.showWHM:
-            time.sleep(0.1)
-            self.setPointsWHM.stopit()
+        self.captureEngine.stopit() # stops the algorithms
 
-        # self.save_file.close()
+    def closeEvent(self, event):
+        """
+        Stop recording and write out whatever history is still queued when the window closes
+        :param event: The close event
+        :return: None
+        """
+        # Nothing may reach the slots once the history is closed, its writes would raise
+        if self.captureEngine.isRunning():
+            self.captureEngine.stopit()
+        self.setPointsCTWM.finished.disconnect(self.updateCTWM)
+        self.setPointsWHM.finished.disconnect(self.updateWHM)
+        self.reportMetrics()
+        self.setPointsCTWM.close()
+        self.setPointsWHM.close()
+        # Both monitors append to the same store, closing it twice is fine
+        for algorithm in (self.setPointsCTWM, self.setPointsWHM):
+            if algorithm.store is not None:
+                algorithm.store.close()
+        self.history.close()
+        QtWidgets.QMainWindow.closeEvent(self, event)
+
+    def reportMetrics(self):
+        """
+        Print the latency report when verbose and export it to the metrics file
+        :return: None
+        """
+        if self.captureEngine.verbose > 0:
+            print(self.metrics.summary())
+        if args.metrics_file:
+            self.metrics.export(args.metrics_file)
 
     def saveWindowState(self):
         """
@@ -264,15 +325,15 @@ class UI(QtWidgets.QMainWindow):
         :return: None
         """
         print("Reset button has been pressed!")
-        self.save_file = open(os.path.join(args.parent_img_path, self.save_file_name), "a")
-        self.save_file.write("\n" + "-------*Reset Button Pressed*-------" + "\n")
-        self.save_file.close()
+        self.history.write("\n" + "-------*Reset Button Pressed*-------" + "\n", event="reset")
+        self.drawnSpans = dict()
         # CTWM Resetting
         if self.showCTWM:
-            self.outcomesCTWM = np.array([])
-            self.CTWMx = [0]
-            self.CTWMy = [0]
-            self.curveCTWMGraph.setData(x=self.CTWMx, y=self.CTWMy)
+            self.lastCTWM = None
+            self.shownCTWM = None
+            self.dirtyCTWM = False
+            self.dataCTWM.clear()
+            self.curveCTWMGraph.setData(x=[0], y=[0])
             self.CTWMGraph.clear()
             self.CTWMGraph.draw()
             # Does what initImgCTWM does
@@ -283,7 +344,10 @@ class UI(QtWidgets.QMainWindow):
 
         # WHM resetting
         if self.showWHM:
-            self.outcomesWHM = np.array([])
+            self.lastWHM = None
+            self.shownWHM = None
+            self.dirtyWHM = False
+            self.dataWHM.clear()
             self.curveWHMGraph.setData(x=[0], y=[0])
             self.WHMGraph.clear()
             self.WHMGraph.draw()
@@ -297,14 +361,14 @@ class UI(QtWidgets.QMainWindow):
         if self.showRTLE:
             self.speed.setText("")
             self.feed.setText("")
-            self.RTLEGraph.clear()
-            self.RTLEGraph.draw()
+            self.toolLife = None
+            self.shownRTLE = None
             self.labelTimeAverageWear.setText("")
             self.labelTimeAdvancedWear.setText("")
             self.labelTimeFailureWear.setText("")
-            self.curveRTLEGraph = pg.BarGraphItem(name="RLTEGraph", x=[1], height=30, width=3, brush='d9d9d9')
-            self.curveRTLEGraph.rotate(-90)  # horizontal graph
-            self.RTLEGraph.addItem(self.curveRTLEGraph)
+            self.RTLEGraph.setLabel("bottom", "")
+            self.curveRTLEGraphTotal.setOpts(height=30)
+            self.currentWear.setOpts(height=0)
 
         ###############################################################################################################
         #                                                                                                             #
@@ -317,7 +381,10 @@ class UI(QtWidgets.QMainWindow):
         :return: None
         """
 
-        self.dataCTWM = deque(maxlen=100) # change this for how many seconds are visible before scrolling
+        if args.long_history: # the whole session, zoomable
+            self.dataCTWM = DecimatedSeries()
+        else:
+            self.dataCTWM = PlotBuffer(args.plot_points or 100) # how many points are visible before scrolling
 
         # To create one "big" widget, use a VBox
         self.secondRowCTWM = QtWidgets.QVBoxLayout()
@@ -393,8 +460,10 @@ class UI(QtWidgets.QMainWindow):
         self.CTWMGraph.setLabel('left', "Tool Condition")
         self.CTWMGraph.setLabel('bottom', "Time", units='s')
         self.CTWMGraph.enableAutoRange(axis=pg.ViewBox.YAxis, enable=False)
-        self.CTWMGraph.setMouseEnabled(x=False, y=False)
+        self.CTWMGraph.setMouseEnabled(x=args.long_history, y=False)
         self.curveCTWMGraph = self.CTWMGraph.plot(pen=self.pen)
+        if args.long_history: # zooming or panning needs the points of the new range
+            self.CTWMGraph.sigXRangeChanged.connect(self.zoomCTWM)
 
         # Add the graph to the label/graph layout
         self.CTWMlabelGraph.addWidget(self.CTWMGraph)
@@ -414,7 +483,10 @@ class UI(QtWidgets.QMainWindow):
         :return: None
         """
 
-        self.dataWHM = deque(maxlen=60)
+        if args.long_history:
+            self.dataWHM = DecimatedSeries()
+        else:
+            self.dataWHM = PlotBuffer(args.plot_points or 60)
 
         # To create on "big" widget, use Vbox
         self.secondRowWHM = QtWidgets.QVBoxLayout()
@@ -464,8 +536,10 @@ class UI(QtWidgets.QMainWindow):
         self.WHMGraph.setLabel('left', 'Level')
         self.WHMGraph.setLabel('bottom', 'Time', units='s')
         self.WHMGraph.enableAutoRange(axis=pg.ViewBox.YAxis, enable=False)
-        self.WHMGraph.setMouseEnabled(x=False, y=False)
+        self.WHMGraph.setMouseEnabled(x=args.long_history, y=False)
         self.curveWHMGraph = self.WHMGraph.plot(pen=self.pen)
+        if args.long_history:
+            self.WHMGraph.sigXRangeChanged.connect(self.zoomWHM)
 
         # Add the graph to the label/graph layout
         self.WHMlabelGraph.addWidget(self.WHMGraph)
@@ -531,6 +605,10 @@ class UI(QtWidgets.QMainWindow):
         self.computeButton.setFixedWidth(70)
         self.computeButton.clicked.connect(self.updateRTLE)
         self.RTLEuserInput.addRow(self.computeButton)
+        self.whatIfButton = QtWidgets.QPushButton("What-if")
+        self.whatIfButton.setFixedWidth(70)
+        self.whatIfButton.clicked.connect(self.updateWhatIf)
+        self.RTLEuserInput.addRow(self.whatIfButton)
         # Add the user input information to the HBox that holds the info, label, and graph
         self.RTLEInfoLabelGraph.addLayout(self.RTLEuserInput)
 
@@ -566,13 +644,34 @@ class UI(QtWidgets.QMainWindow):
         self.RTLEGraph.hideAxis("left")
         self.RTLEGraph.getAxis('bottom').setTicks([[(0, "Failure"), (1, "Advanced"), (2, "Average"), (3, "Good")]])
         self.RTLEGraph.hideAxis("bottom")
-        self.curveRTLEGraph = pg.BarGraphItem(name="RLTEGraph", x=x, height=y, width=3, brush='d9d9d9')
-        self.curveRTLEGraph.rotate(-90)  # horizontal graph
-        self.RTLEGraph.addItem(self.curveRTLEGraph)
+        # Both bars stay in the graph, updates only change their height and color
+        self.curveRTLEGraphTotal = pg.BarGraphItem(name="RLTEGraph", x=x, height=y, width=3, brush='d9d9d9')
+        self.curveRTLEGraphTotal.rotate(-90)  # horizontal graph
+        self.RTLEGraph.addItem(self.curveRTLEGraphTotal)
+        self.currentWear = pg.BarGraphItem(x=x, height=0, width=3)
+        self.currentWear.rotate(-90)
+        self.RTLEGraph.addItem(self.currentWear)
 
         # Add the graph to the HBox that holds the info, labels, and the graph
         self.RTLEInfoLabelGraph.addWidget(self.RTLEGraph)
 
+        # Heatmap of the tool life around the entered speed and feed, hidden until What-if is pressed
+        self.whatIf = WhatIfEngine()
+        self.whatIfGraph = pg.PlotWidget()
+        self.whatIfGraph.setLabel('bottom', "Speed", units='RPM')
+        self.whatIfGraph.setLabel('left', "Feed Rate", units='IPM')
+        self.whatIfGraph.setTitle("log10 Tool Life (MIN)")
+        self.whatIfImage = pg.ImageItem()
+        # Short tool life in red, long in green
+        ramp = np.linspace(0., 1., 256)
+        self.whatIfImage.setLookupTable((np.column_stack([1. - ramp, ramp, 0.2 * np.ones(256)]) * 255)
+                                        .astype(np.uint8))
+        self.whatIfGraph.addItem(self.whatIfImage)
+        # The entered speed and feed
+        self.whatIfMarker = self.whatIfGraph.plot(pen=None, symbol='o', symbolBrush='w')
+        self.whatIfGraph.hide()
+        self.RTLEInfoLabelGraph.addWidget(self.whatIfGraph)
+
         self.thirdRowRTLE.addLayout(self.RTLEInfoLabelGraph)
 
         self.groupRTLE = QGroupBox()
@@ -655,14 +754,136 @@ class UI(QtWidgets.QMainWindow):
         #                                        ALL UPDATE METHODS FOR THE WIDGETS                                   #
         #                                                                                                             #
         ###############################################################################################################
-    @pyqtSlot(int)
-    def updateCTWM(self, wear):
+    @pyqtSlot(int, float)
+    def updateCTWM(self, wear, emitted):
         """
-        The real-part where threading takes place - Update the image according to the prediction
+        The real-part where threading takes place - Record the prediction. The widget is repainted by renderFrame
         :param wear: The prediction number - between 1 and 4
+        :param emitted: clock() when the algorithm sent the prediction
+        :return: None
+        """
+        self.metrics.since("delivery", emitted)
+
+        self.lastCTWM = wear
+        elapsed = self.tmr.elapsed()/float(1000)
+        self.history.write("Time Elapsed: (" + str(elapsed)+" sec) - Tool Wear: "+str(wear)+", \n",
+                           event="CTWM", elapsed=elapsed, wear=wear)
+        self.dataCTWM.append(elapsed, wear)
+        self.dirtyCTWM = True
+        #self.save.clicked.connect(self.saveGraph(self.addressBox))
+
+    @pyqtSlot(int, float)
+    def updateWHM(self, hardnessLevel, emitted):
+        """
+        The real-part where threading takes place - Record the prediction. The widget is repainted by renderFrame
+        :parhardnessLevel: The prediction number - between 1 and 4
+        :param emitted: clock() when the algorithm sent the prediction
+        :return: None
+        """
+        self.metrics.since("delivery", emitted)
+
+        self.lastWHM = hardnessLevel
+        elapsed = self.tmr.elapsed() / float(1000)
+        self.history.write("Time Elapsed: (" + str(elapsed) + " sec) - Hardness Level: " + str(hardnessLevel) +
+                           ",\n", event="WHM", elapsed=elapsed, level=hardnessLevel)
+        self.dataWHM.append(elapsed, hardnessLevel)
+        self.dirtyWHM = True
+
+    def renderFrame(self):
+        """
+        Repaint the CTWM and WHM widgets with the latest predictions. Called by renderTimer at a fixed frame rate, so
+        predictions arriving faster than that are coalesced into one repaint
         :return: None
         """
+        if self.showCTWM and self.dirtyCTWM:
+            start = clock()
+            self.dirtyCTWM = False
+            # Images only change with the level
+            if self.lastCTWM != self.shownCTWM:
+                self.paintCTWM(self.lastCTWM)
+                self.shownCTWM = self.lastCTWM
+            x, y = self.plotData(self.CTWMGraph, self.dataCTWM)
+            self.curveCTWMGraph.setData(x=x, y=y)
+            self.metrics.since("paint", start)
+
+        if self.showWHM and self.dirtyWHM:
+            start = clock()
+            self.dirtyWHM = False
+            if self.lastWHM != self.shownWHM:
+                self.paintWHM(self.lastWHM)
+                self.shownWHM = self.lastWHM
+            x, y = self.plotData(self.WHMGraph, self.dataWHM)
+            self.curveWHMGraph.setData(x=x, y=y)
+            self.metrics.since("paint", start)
+
+        # The remaining tool life follows the wear, once Compute has given the tool life
+        if self.showRTLE and self.toolLife is not None:
+            if self.lastCTWM != self.shownRTLE:
+                self.paintRTLE(self.lastCTWM)
+            else:
+                self.logRTLE()
+
+    def plotData(self, graph, data):
+        """
+        Points of a graph's curve
+        :param graph: PlotWidget showing the curve
+        :param data: PlotBuffer of the latest points, or DecimatedSeries of the whole session
+        :return: (x, y) arrays owned by the caller
+        """
+        if isinstance(data, PlotBuffer):
+            # The curve keeps the arrays it is given, views of the ring buffers would change under it
+            return data.x().copy(), data.y().copy()
+        view = self.viewQuery(graph, data)
+        self.drawnSpans[data] = data.span(*view)
+        return data.query(*view)
+
+    def viewQuery(self, graph, data):
+        """
+        Range of a DecimatedSeries a graph shows
+        :param graph: PlotWidget showing the curve
+        :param data: DecimatedSeries of the whole session
+        :return: (left X, right X, points) to query
+        """
+        if graph.getViewBox().autoRangeEnabled()[0]:
+            # Following the data, so the view is the whole session
+            x0, x1 = data.range() or (0., 0.)
+        else:
+            x0, x1 = graph.viewRange()[0]
+        # About two points per pixel column, whatever the length of the range
+        return x0, x1, max(graph.width(), 100)
+
+    def zoomed(self, graph, data):
+        """
+        Whether a graph's new range needs other points than the ones drawn. With auto range, drawing new points moves
+        the range on every frame without changing what the query returns
+        :param graph: PlotWidget showing the curve
+        :param data: DecimatedSeries of the whole session
+        :return: boolean
+        """
+        return data.span(*self.viewQuery(graph, data)) != self.drawnSpans.get(data)
+
+    def zoomCTWM(self):
+        """
+        The CTWM graph was zoomed or panned, redraw it on the next frame if that shows other points
+        :return: None
+        """
+        if self.zoomed(self.CTWMGraph, self.dataCTWM):
+            self.dirtyCTWM = True
+
+    def zoomWHM(self):
+        """
+        The WHM graph was zoomed or panned, redraw it on the next frame if that shows other points
+        :return: None
+        """
+        if self.zoomed(self.WHMGraph, self.dataWHM):
+            self.dirtyWHM = True
 
+    def paintCTWM(self, wear):
+        """
+        Update the image according to the prediction
+        :param wear: The prediction number - between 1 and 4
+        :return: None
+        """
         if wear == 1:
             self.labelGoodGrayCTWM.setPixmap(self.images['imageGoodGreenCTWM'])
             self.labelAverageGrayCTWM.setPixmap(self.images['imageAverageGrayCTWM'])
@@ -687,36 +908,18 @@ class UI(QtWidgets.QMainWindow):
             self.labelAdvancedGrayCTWM.setPixmap(self.images['imageAdvancedGrayCTWM'])
             self.labelFailureGrayCTWM.setPixmap(self.images['imageFailureRedCTWM'])
 
-        self.outcomesCTWM = np.append(self.outcomesCTWM, wear)
-
-        if self.outcomesCTWM.size > 0:
-            elapsed = self.tmr.elapsed()/float(1000)
-            self.save_file = open(os.path.join(args.parent_img_path, self.save_file_name), "a")
-            self.save_file.write("Time Elapsed: (" + str(elapsed)+" sec) - Tool Wear: "+str(wear)+", \n")
-            self.save_file.close()
-            self.dataCTWM.append({'x': elapsed, 'y': wear})
-            self.CTWMx = [item['x'] for item in self.dataCTWM]
-            self.CTWMy = [item['y'] for item in self.dataCTWM]
-            self.CTWMx = np.asarray(self.CTWMx).flatten()
-            self.CTWMy = np.asarray(self.CTWMy).flatten()
-            self.curveCTWMGraph.setData(x=self.CTWMx, y=self.CTWMy)
-            #self.save.clicked.connect(self.saveGraph(self.addressBox))
-
-    @pyqtSlot(int)
-    def updateWHM(self, hardnessLevel):
-        """
-        The real-part where threading takes place - Update the image according to the prediction
-        :parhardnessLevel: The prediction number - between 1 and 4
+    def paintWHM(self, hardnessLevel):
+        """
+        Update the image according to the prediction
+        :param hardnessLevel: The prediction number - between 1 and 4
         :return: None
         """
-
         if hardnessLevel == 1:
             self.labelLevelOneWHM.setPixmap(self.images['imageLevelOneWHMgreen'])
             self.labelLevelTwoWHM.setPixmap(self.images['imageLevelTwoWHMgray'])
             self.labelLevelThreeWHM.setPixmap(self.images['imageLevelThreeWHMgray'])
             self.labelLevelFourWHM.setPixmap(self.images['imageLevelFourWHMgray'])
 
-
         elif hardnessLevel == 2:
             self.labelLevelTwoWHM.setPixmap(self.images['imageLevelTwoWHMyellow'])
             self.labelLevelOneWHM.setPixmap(self.images['imageLevelOneWHMgray'])
@@ -735,129 +938,109 @@ class UI(QtWidgets.QMainWindow):
             self.labelLevelTwoWHM.setPixmap(self.images['imageLevelTwoWHMgray'])
             self.labelLevelThreeWHM.setPixmap(self.images['imageLevelThreeWHMgray'])
 
-        self.outcomesWHM = np.append(self.outcomesWHM, hardnessLevel)
-
-        if self.outcomesWHM.size > 0:
-            elapsed = self.tmr.elapsed() / float(1000)
-            self.save_file = open(os.path.join(args.parent_img_path, self.save_file_name), "a")
-            self.save_file.write("Time Elapsed: (" + str(elapsed) + " sec) - Hardness Level: "+str(hardnessLevel)+",\n")
-            self.save_file.close()
-            self.dataWHM.append({'x': elapsed, 'y': hardnessLevel})
-            self.WHMx = [item['x'] for item in self.dataWHM]
-            self.WHMy = [item['y'] for item in self.dataWHM]
-            self.WHMx = np.asarray(self.WHMx).flatten()
-            self.WHMy = np.asarray(self.WHMy).flatten()
-            self.curveWHMGraph.setData(x=self.WHMx, y=self.WHMy)
-
-        # Stuff for Verbose - Helpful for debugging
-        if self.setPointsWHM.verbose > 0:
-            if self.setPointsWHM.verbose > 0:
-                print 'Receive Time: {:0.6f}ms | Pre-process + SVM Run Time: {:0.6f}ms | Total Run Time: {:0.6f}ms'.format(
-                    (self.setPointsWHM.algo_time - self.setPointsWHM.receive_time) * 1000.,
-                    (self.setPointsWHM.final_time - self.setPointsWHM.algo_time) * 1000.,
-                    (time.time() - self.showtime) * 1000.)
-                # reset Showtime
-                self.showtime = time.time()
-                # print ' Total Showtime: {:0.6f}ms \n \n'.format((time.time() - self.showtime) * 1000.)
-
     def updateRTLE(self):
         """
-        Update the labels of the RTLE widget
+        Compute the tool life of the entered parameters. The widget then follows the wear predictions by itself
         :return: None
         """
-        x = [1]
-
-
         self.V = self.cuttingSpeed(diameter=float(self.radialDOC.text()),
                                    rpm=float(self.speed.text()))  # V: cutting speed
 
         self.toolLife = self.algoRTLE(V=self.V, d=float(self.radialDOC.text()),
                                       f=float(self.feed.text()),rpm=float(self.speed.text()),
-                                      flute=float(self.flutes.text()))  # Calculate remaining tool life
+                                      flute=float(self.flutes_text))  # Calculate remaining tool life
         self.RTLEGraph.setXRange(0, self.toolLife) # Set the X-Range according to the remaining tool life
 
         self.timeAverageWear = self.toolLife - (0.5 * self.toolLife)
         self.timeAdvancedWear = self.timeAverageWear + (0.25 * self.toolLife)
         self.timeFailureWear = self.timeAdvancedWear + (0.25 * self.toolLife)
 
-        advancedtime = self.timeFailureWear - self.timeAdvancedWear
-        averagetime = self.timeFailureWear - self.timeAverageWear
-        currentwidth = 3
-        self.currentWear = pg.BarGraphItem(x=x, height=0, width=currentwidth)
-
-        if self.outcomesCTWM.size > 0:
-            if self.outcomesCTWM[-1] == 1:
-                self.save_file = open(os.path.join(args.parent_img_path, self.save_file_name), "a")
-                self.save_file.write("\nRemaining Tool Life Estimation\n")
-                self.save_file.write("Average: "+str(self.timeAverageWear)+" min, ")
-                self.save_file.write("Advanced: "+str(self.timeAdvancedWear)+" min, ")
-                self.save_file.write("Failure: "+str(self.timeFailureWear)+" min, \n")
-                self.save_file.close()
-                self.labelTimeAverageWear.setText(str(self.timeAverageWear))
-                self.labelTimeAdvancedWear.setText(str(self.timeAdvancedWear))
-                self.labelTimeFailureWear.setText(str(self.timeFailureWear))
-                self.currentWear = pg.BarGraphItem(x=x, height=self.timeFailureWear, width=currentwidth,
-                                                   brush=(54,183,41))
-                self.RTLEGraph.setLabel("bottom", "Tool Life Remaining: 100%")
-
-            elif self.outcomesCTWM[-1] == 2:
-                self.save_file = open(os.path.join(args.parent_img_path, self.save_file_name), "a")
-                self.save_file.write("\nRemaining Tool Life Estimation\n")
-                self.save_file.write("Average: N/A, ")
-                self.save_file.write("Advanced: "+str(self.timeAdvancedWear)+" min, ")
-                self.save_file.write("Failure: "+str(self.timeFailureWear)+" min \n")
-                self.save_file.close()
-                self.labelTimeAverageWear.setText("N/A")
-                self.labelTimeAdvancedWear.setText(str(self.timeAdvancedWear))
-                self.labelTimeFailureWear.setText(str(self.timeFailureWear))
-                self.currentWear = pg.BarGraphItem(x=x, height=averagetime, width=currentwidth,
-                                                   brush=(221,215,69))
-                percent = str((averagetime/self.timeFailureWear)*100)
-                self.RTLEGraph.setLabel("bottom", "Tool Life Remaining: "+percent+"%")
-
-            elif self.outcomesCTWM[-1] == 3:
-                self.save_file = open(os.path.join(args.parent_img_path, self.save_file_name), "a")
-                self.save_file.write("\nRemaining Tool Life Estimation\n")
-                self.save_file.write("Average: N/A, ")
-                self.save_file.write("Advanced: N/A, ")
-                self.save_file.write("Failure: "+str(self.timeFailureWear)+" min \n")
-                self.save_file.close()
-                self.labelTimeAverageWear.setText("N/A")
-                self.labelTimeAdvancedWear.setText("N/A")
-                self.labelTimeFailureWear.setText(str(self.timeFailureWear))
-                self.currentWear = pg.BarGraphItem(x=x, height=advancedtime, width=currentwidth,
-                                                   brush=(255,188,73))
-                percent = str((advancedtime/self.timeFailureWear)*100)
-
-                self.RTLEGraph.setLabel("bottom", "Tool Life Remaining: "+percent+"%")
-
-
-            elif self.outcomesCTWM[-1] == 4:
-                self.save_file = open(os.path.join(args.parent_img_path, self.save_file_name), "a")
-                self.save_file.write("\nRemaining Tool Life Estimation\n")
-                self.save_file.write("Average: N/A, ")
-                self.save_file.write("Advanced: N/A, ")
-                self.save_file.write("Failure: N/A \n")
-                self.save_file.close()
-                self.labelTimeAverageWear.setText("N/A")
-                self.labelTimeAdvancedWear.setText("N/A")
-                self.labelTimeFailureWear.setText("N/A")
-                self.currentWear = pg.BarGraphItem(x=x, height=self.timeFailureWear/80, width=currentwidth,
-                                                   brush=(253,94,91))
-                self.RTLEGraph.setLabel("bottom", "Tool Life Remaining: 0%")
+        self.advancedTime = self.timeFailureWear - self.timeAdvancedWear
+        self.averageTime = self.timeFailureWear - self.timeAverageWear
 
         # layered bar graph to show differences in good, average, advanced, failure
         self.RTLEGraph.getAxis('bottom').setTicks([[(0, "Failure"),
-                                                    (advancedtime, "Advanced"),
-                                                    (averagetime, "Average"),
+                                                    (self.advancedTime, "Advanced"),
+                                                    (self.averageTime, "Average"),
                                                     (self.timeFailureWear, "Good")]])
+        self.curveRTLEGraphTotal.setOpts(height=self.timeFailureWear)
 
-        self.RTLEGraph.clear()
-        self.curveRTLEGraphTotal = pg.BarGraphItem(x=x, height=self.timeFailureWear, width=3, brush="d9d9d9")
-        self.curveRTLEGraphTotal.rotate(-90)
-        self.currentWear.rotate(-90)
-        self.RTLEGraph.addItem(self.curveRTLEGraphTotal)
-        self.RTLEGraph.addItem(self.currentWear)
+        self.shownRTLE = None
+        # A new estimate is written right away
+        self.loggedRTLE = None
+        self.loggedRTLETime = None
+        self.paintRTLE(self.lastCTWM)
+
+    def paintRTLE(self, wear):
+        """
+        Show the remaining tool life for a wear level. Only updates the labels and the bar in place
+        :param wear: The prediction number - between 1 and 4, or None before the first prediction
+        :return: None
+        """
+        self.shownRTLE = wear
+
+        if wear == 1:
+            self.labelTimeAverageWear.setText(str(self.timeAverageWear))
+            self.labelTimeAdvancedWear.setText(str(self.timeAdvancedWear))
+            self.labelTimeFailureWear.setText(str(self.timeFailureWear))
+            self.currentWear.setOpts(height=self.timeFailureWear, brush=(54,183,41))
+            self.RTLEGraph.setLabel("bottom", "Tool Life Remaining: 100%")
+
+        elif wear == 2:
+            self.labelTimeAverageWear.setText("N/A")
+            self.labelTimeAdvancedWear.setText(str(self.timeAdvancedWear))
+            self.labelTimeFailureWear.setText(str(self.timeFailureWear))
+            self.currentWear.setOpts(height=self.averageTime, brush=(221,215,69))
+            percent = str((self.averageTime/self.timeFailureWear)*100)
+            self.RTLEGraph.setLabel("bottom", "Tool Life Remaining: "+percent+"%")
+
+        elif wear == 3:
+            self.labelTimeAverageWear.setText("N/A")
+            self.labelTimeAdvancedWear.setText("N/A")
+            self.labelTimeFailureWear.setText(str(self.timeFailureWear))
+            self.currentWear.setOpts(height=self.advancedTime, brush=(255,188,73))
+            percent = str((self.advancedTime/self.timeFailureWear)*100)
+            self.RTLEGraph.setLabel("bottom", "Tool Life Remaining: "+percent+"%")
+
+        elif wear == 4:
+            self.labelTimeAverageWear.setText("N/A")
+            self.labelTimeAdvancedWear.setText("N/A")
+            self.labelTimeFailureWear.setText("N/A")
+            self.currentWear.setOpts(height=self.timeFailureWear/80, brush=(253,94,91))
+            self.RTLEGraph.setLabel("bottom", "Tool Life Remaining: 0%")
+
+        else:
+            self.currentWear.setOpts(height=0)
+        self.logRTLE()
+
+    def logRTLE(self):
+        """
+        Write the remaining tool life estimate shown to the history. A noisy wear prediction flips the level often, so
+        a level is only written when it differs from the one written last, and at most every RTLE_LOG_INTERVAL seconds.
+        renderFrame calls this again until a held back level is written
+        :return: None
+        """
+        wear = self.shownRTLE
+        if wear not in (1, 2, 3, 4) or wear == self.loggedRTLE:
+            return
+        now = clock()
+        if self.loggedRTLETime is not None and now - self.loggedRTLETime < self.RTLE_LOG_INTERVAL:
+            return
+        self.loggedRTLE = wear
+        self.loggedRTLETime = now
+        # Minutes left until each level, N/A once the tool is past it
+        average = self.timeAverageWear if wear <= 1 else None
+        advanced = self.timeAdvancedWear if wear <= 2 else None
+        failure = self.timeFailureWear if wear <= 3 else None
+
+        def minutes(value):
+            return "N/A" if value is None else str(value) + " min"
+
+        self.history.write("\nRemaining Tool Life Estimation\n" +
+                           "Average: " + minutes(average) + ", " +
+                           "Advanced: " + minutes(advanced) + ", " +
+                           "Failure: " + minutes(failure) + " \n",
+                           event="RTLE", average=average, advanced=advanced, failure=failure)
 
         ###############################################################################################################
         #                                                                                                             #
@@ -871,7 +1054,7 @@ class UI(QtWidgets.QMainWindow):
         :param rpm: Speed
         :return: V: cutting speed in ft/min
         """
-        return (math.pi * diameter * rpm)/12
+        return float(cutting_speed(diameter, rpm))
 
     def algoRTLE(self, V, d, f, rpm, flute):
         """
@@ -881,78 +1064,167 @@ class UI(QtWidgets.QMainWindow):
         :param f: Feed rate in in/min
         :return:
         """
-        return math.pow(100, (1/0.15)) * math.pow(V, (-1/0.15)) * math.pow((d*25.4), -1) * math.pow(((f/(rpm * flute)) *
-                                                                                                     25.4), (-0.1/0.15))
+        return float(tool_life(V, d, f, rpm, flute))
 
-class Algorithm(QThread):
+    def updateWhatIf(self):
+        """
+        Show the tool life of every speed and feed from half to one and a half times the entered ones, at the entered
+        radial DOC
+        :return: None
+        """
+        rpm = float(self.speed.text())
+        feed = float(self.feed.text())
+        rpms, feeds, _, life = self.whatIf.grid(float(self.flutes_text), (0.5 * rpm, 1.5 * rpm, 200),
+                                                (0.5 * feed, 1.5 * feed, 200), float(self.radialDOC.text()))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            image = np.log10(life[:, :, 0])
+        finite = image[np.isfinite(image)]
+        if finite.size == 0:
+            return
+        # Rows are speeds and columns feeds, so speed runs along x
+        self.whatIfImage.setImage(image, levels=(finite.min(), finite.max()))
+        self.whatIfImage.setRect(QtCore.QRectF(rpms[0], feeds[0], rpms[-1] - rpms[0], feeds[-1] - feeds[0]))
+        self.whatIfMarker.setData([rpm], [feed])
+        self.whatIfGraph.show()
+
+class CaptureEngine(QThread):
     """
-    Class to run the actual algorithm, which is taking in audio data and refers to the PKL file for a prediction number
+    Class that owns the audio stream, or the recording replayed instead of it. The audio is captured and windowed once,
+    and each window's spectrum is fanned out to every registered Algorithm
     """
-    finished = pyqtSignal(int)
 
     # Set variables for PyAudio
     CHANNELS = 1
     RATE = 44100
     # Instantiate PyAudio
     p = None
-    # Instantiate a NumPy array
-    audio = np.array([])
     # For checking stop button
     stop = QTimer()
     # For opening audio stream
     stream = None
 
-    def __init__(self, clf_path, window_length=0.05, rate=44100, verbose=0):
+    def __init__(self, window_length=0.05, rate=44100, verbose=0, history_length=10., spill_path=None,
+                 queue_size=64, drop_policy=DropQueue.DROP_OLDEST, hop_length=None, batch_size=1, batch_latency=0.1,
+                 source=None, replay_speed=1., features="spectrum", n_features=128):
         """
-        Initialize the algorithm
-        :param clf_path: Path of the PKL file
+        Initialize the capture engine
         :param window_length: Length of the amount of data to be read
-        :param rate: Rate at which information is stored
+        :param hop_length: Seconds between consecutive windows, defaults to window_length (no overlap)
+        :param batch_size: Number of windows each algorithm predicts in one call
+        :param batch_latency: Seconds a partial batch may wait before it is predicted anyway
+        :param source: FileSource to replay instead of opening the microphone, None for live capture
+        :param replay_speed: Speed of the replay relative to real time, 0 for as fast as possible
+        :param features: Input of the algorithms, "spectrum", "bands" or "logmel"
+        :param n_features: Number of compact features
+        :param rate: Rate at which information is stored. A replayed recording is processed at its own rate
         :param verbose: Used for printing debug data
+        :param history_length: Seconds of raw audio kept in memory
+        :param spill_path: Path of the file the whole raw capture is streamed to, None to keep only the memory tail
+        :param queue_size: Number of audio chunks waiting for the classifiers before some are dropped
+        :param drop_policy: Which chunk to drop when the queue is full, "oldest" or "newest"
         """
         self.verbose = verbose
-        self.clf = joblib.load(clf_path)
-        self.rate = rate
-        self.count = int(np.floor(self.rate * window_length))
-        self.audio = deque(maxlen=self.count)
-        self.t = None
+        # A WAV file carries its own rate, the windows and spectra have to be built for it
+        self.rate = rate if source is None else source.rate
         self.window_length = window_length
-
-        self.comparableAudio = np.array([])
+        # Latency of every stage from the callback to the paint, shared with the algorithms and the UI
+        self.metrics = Metrics()
+        self.pipeline = Pipeline(rate=self.rate, window_length=window_length, hop_length=hop_length,
+                                 batch_size=batch_size, max_latency=batch_latency, features=features,
+                                 n_features=n_features, metrics=self.metrics)
+        self.count = self.pipeline.count
+
+        # Bounded so long runs stay flat in RAM
+        self.comparableAudio = AudioHistory(self.rate, history_length=history_length, spill_path=spill_path)
+
+        # Chunks handed from the PortAudio callback to this thread, which does the FFT and predictions
+        self.chunks = DropQueue(maxsize=queue_size, policy=drop_policy)
+        # Number of callbacks where PortAudio reported an input overflow, and of the last chunk queued
+        self.overflows = 0
+        self.sequence = 0
+        self.running = False
+        self.metrics.watch("dropped_chunks", lambda: self.chunks.dropped)
+        self.metrics.watch("input_overflows", lambda: self.overflows)
+        self.metrics.watch("queue_depth", self.queue_depth)
+
+        self.source = source
+        self.replay_speed = replay_speed
 
         QThread.__init__(self)
 
+    def register(self, algorithm):
+        """
+        Send every window's spectrum to an algorithm
+        :param algorithm: Algorithm to run on the captured audio
+        :return: None
+        """
+        self.pipeline.check_features(algorithm.clf)
+        algorithm.attach(self.pipeline)
+        self.pipeline.register(algorithm)
+
     def run(self):
         """
-        Algorithm that initializes PyAudio and opens stream
+        Algorithm that initializes PyAudio, opens stream and then consumes the captured audio until stopped
         :return: None
         """
+        if self.source is not None:
+            self.running = True
+            replay(self.source, self.pipeline, speed=self.replay_speed, running=lambda: self.running)
+            print("Replay of " + self.source.path + " finished!")
+            return
+
         self.p = pyaudio.PyAudio()
         self.stream = self.p.open(format=pyaudio.paFloat32, channels=self.CHANNELS, rate=self.RATE, input=True,
                                   output=False, stream_callback=self.callback)
+        self.running = True
         self.stream.start_stream()
         self.stop.setSingleShot(True)
         self.stop.start()
 
-    def callback(self, in_data, *kwargs):
+        while self.running:
+            # Never a zero timeout, with --batch_latency 0 that would spin the thread
+            item = self.chunks.get(timeout=max(1e-3, min(0.1, self.pipeline.max_latency)))
+            if item is None:
+                # No audio arriving, still hand over a batch that has waited long enough
+                self.pipeline.poll()
+                continue
+            receive_time, sequence, captured, audio_data = item
+            self.metrics.since("queue", receive_time)
+            # Runs every registered algorithm on each batch of windows completed by this chunk. The sequence number
+            # tells the pipeline when chunks were dropped in between
+            if self.pipeline.feed(audio_data, sequence=sequence, timestamp=captured):
+                if self.verbose > 1:
+                    print('Batch size: ' + str(self.pipeline.last_batch_size) +
+                          ' | Batch latency: {:0.3f}ms'.format(self.pipeline.last_batch_latency * 1000.))
+            self.comparableAudio.extend(audio_data)
+
+    def callback(self, in_data, frame_count, time_info, status):
         """
-        Call backfunction to execute in a while loop for stream
+        Call backfunction to execute in a while loop for stream. Only queues the data so the audio driver is never
+        held up by the classifiers
         :param in_data: In data Stream
-        :param kwargs: Extra arguments coming from c
-        allback by stream
+        :param frame_count: Number of frames in in_data
+        :param time_info: Timing information from PortAudio
+        :param status: PortAudio status flags
         :return: audio data
         """
-        self.receive_time = time.time()
-        audio_data = np.fromstring(in_data, dtype=np.float32)
-        self.audio.extend(audio_data)
-        # if the queue is full then run SVM
-        if len(self.audio) == self.count:
-            self.algo_time = time.time()
-            self.algo()
-            self.final_time = time.time()
-        self.comparableAudio = np.append(self.comparableAudio, audio_data)
+        start = clock()
+        if status & pyaudio.paInputOverflow:
+            self.overflows += 1
+        audio_data = np.frombuffer(in_data, dtype=np.float32)
+        # Counts the chunks the queue drops too, so the capture thread sees where audio is missing
+        self.sequence += 1
+        self.chunks.put((start, self.sequence, time.time(), audio_data))
+        self.metrics.since("callback", start)
         return audio_data, pyaudio.paContinue
 
+    def queue_depth(self):
+        """
+        Number of audio chunks waiting for the classifiers
+        :return: int
+        """
+        return len(self.chunks)
+
     def stopit(self):
         """
         Algorithm that terminates PyAudio and closes the stream
@@ -960,29 +1232,156 @@ class Algorithm(QThread):
         """
 
         self.stop.stop()
-        self.stream.close()
-        self.p.terminate()
-        self.p = None
+        self.running = False
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+            self.p.terminate()
+            self.p = None
+        # Let the current window finish before touching the buffers it uses
+        self.wait()
+        self.chunks.clear()
+        self.pipeline.reset()
+        self.comparableAudio.close()
 
         print("Recording terminated!")
+        if self.chunks.dropped or self.overflows:
+            print("Dropped chunks: " + str(self.chunks.dropped) + ", input overflows: " + str(self.overflows))
+        if self.verbose > 0:
+            print(self.metrics.summary())
 
 
-    def algo(self):
+class Algorithm(QObject):
+    """
+    Class to run the actual algorithm, which is taking in the spectrum of the audio and refers to the PKL file for a
+    prediction number
+    """
+    # Prediction number and clock() when it was sent, to measure the delivery to the GUI thread
+    finished = pyqtSignal(int, float)
+
+    def __init__(self, clf_path, verbose=0, name=None, store=None, metrics=None, workers=0):
         """
-        Algorithm that takes in audio data and refers to the PKL file. Accordingly, emits the number that is the wear
-        status
+        Initialize the algorithm
+        :param clf_path: Path of the PKL file
+        :param verbose: Used for printing debug data
+        :param name: Monitor name the predictions are stored under, "CTWM" or "WHM"
+        :param store: PredictionStore to append every prediction to, None to not store them
+        :param metrics: Metrics to record the prediction time in, None to not record it
+        :param workers: Number of worker processes running the predictions, 0 to predict in the capture thread
+        """
+        QObject.__init__(self)
+        self.verbose = verbose
+        self.clf_path = clf_path
+        # Shared with the other monitor when both use the same file, and usually loaded in the background at start up
+        self.clf = get_model(clf_path)
+        self.name = name
+        self.store = store
+        self.metrics = metrics
+        # Each monitor records its own predict stage, the pools record them from separate threads
+        self.stage = "predict_" + name if name else "predict"
+        self.workers = workers
+        self.pool = None
+        # Pipeline the spectra come from, and the capture times of the batches in flight in the pool
+        self.pipeline = None
+        self.pending = collections.deque()
+        # Cleared the first time the model turns out not to have predict_proba
+        self.hasConfidence = True
+
+    def process(self, spectra):
+        """
+        Algorithm that takes in the spectra of a batch of windows and refers to the PKL file with a single prediction
+        call. Accordingly, emits the numbers that are the wear status, oldest window first
+        :param spectra: (windows, bins) array of magnitude spectra, or of their features
         :return: None
         """
-        audio = np.array([self.audio.popleft() for _ in range(self.count)])
         # Run Classifier
-        wav_data = np.abs(np.fft.rfft(audio.flatten()))
-        if len(wav_data) > 0:
-            pred = self.clf.predict(np.expand_dims(wav_data, 0))
-            if self.verbose > 1:
-                print('The prediction is : ' + str(pred))
-            self.finished.emit(int(pred[-1]))
+        if spectra.shape[1] > 0:
+            times = None
+            if self.pipeline is not None:
+                times = self.pipeline.times[:len(spectra)].copy()
+            if self.pool is not None:
+                # Predicted in a worker process, receive is called with the result
+                self.pending.append(times)
+                self.pool.submit(spectra)
+                return
+            start = clock()
+            pred = self.clf.predict(spectra)
+            if self.metrics is not None:
+                self.metrics.since(self.stage, start)
+            self.deliver(pred, self.confidence(spectra, pred) if self.store is not None else None, None, times)
         else:
-            self.finished.emit(0)
+            for _ in range(len(spectra)):
+                self.finished.emit(0, clock())
+
+    def receive(self, pred, confidences, error):
+        """
+        Result of a batch predicted by the pool. Batches come back in the order they were submitted
+        :param pred: Predicted classes, None when the prediction failed
+        :param confidences: Probability of each predicted class, or None
+        :param error: Message of a failed prediction, or None
+        :return: None
+        """
+        self.deliver(pred, confidences, error, self.pending.popleft())
+
+    def deliver(self, pred, confidences, error, times=None):
+        """
+        Store and emit the predictions of a batch, oldest window first
+        :param pred: Predicted classes, None when the prediction failed
+        :param confidences: Probability of each predicted class, or None
+        :param error: Message of a failed prediction, or None
+        :param times: When the audio of each window was captured, None for now
+        :return: None
+        """
+        if error is not None:
+            print(str(self.name) + " prediction failed: " + error)
+            return
+        if self.verbose > 1:
+            print('The prediction is : ' + str(pred) + ' | Batch size: ' + str(len(pred)))
+        if self.store is not None:
+            self.store.append(self.name, pred, confidences=confidences, times=times)
+        for p in pred:
+            self.finished.emit(int(p), clock())
+
+    def attach(self, pipeline):
+        """
+        Take the spectra of a pipeline, and start the worker processes if any were asked for. The windows reach them
+        through shared memory
+        :param pipeline: Pipeline the algorithm is registered with
+        :return: None
+        """
+        self.pipeline = pipeline
+        if self.workers > 0 and self.pool is None:
+            self.pool = InferencePool(self.clf_path, pipeline.batch.shape[1], pipeline.batch_size, self.receive,
+                                      processes=self.workers, confidence=self.store is not None,
+                                      metrics=self.metrics, stage=self.stage)
+
+    def close(self):
+        """
+        Stop the worker processes after the batches they still have
+        :return: None
+        """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+
+    def confidence(self, spectra, pred):
+        """
+        Probability the model gives its predicted class
+        :param spectra: (windows, bins) array the prediction was made on
+        :param pred: Predicted classes
+        :return: NumPy array, or None when the model has no probabilities
+        """
+        if not self.hasConfidence:
+            return None
+        try:
+            return predicted_probability(self.clf, spectra, pred)
+        except (AttributeError, NotImplementedError):
+            self.hasConfidence = False
+        except Exception as e:
+            # Store the predictions without confidences rather than lose them
+            if self.verbose > 0:
+                print(str(self.name) + " confidence failed: " + str(e))
+        return None
 
 class Dialog(QDialog):
     """
@@ -1035,11 +1434,39 @@ class Dialog(QDialog):
         self.wpmaterial_text = str(self.wpmaterial.currentText())
         self.heat_text = str(self.heat.currentText())
 
-        ctwmGraphPoints = Algorithm(clf_path=args.clf_path_CTWM, window_length=args.window_length, rate=args.rate)
-        whmGraphPoints = Algorithm(clf_path=args.clf_path_WHM, window_length=args.window_length, rate=args.rate)
+        # One capture stream feeds every monitor; its raw audio is spilled to a file named like the history file
+        spill_path = None
+        if args.spill_dir:
+            spill_path = os.path.join(args.spill_dir, "Audio" + str(datetime.now().date()) + ".f32")
+        # Replay a recording instead of listening to the microphone
+        source = None
+        if args.input_file:
+            source = FileSource(args.input_file, rate=args.rate, dtype=args.raw_dtype)
+        captureEngine = CaptureEngine(window_length=args.window_length, rate=args.rate,
+                                      history_length=args.history_length, spill_path=spill_path,
+                                      queue_size=args.queue_size, drop_policy=args.drop_policy,
+                                      hop_length=args.hop_length, batch_size=args.batch_size,
+                                      batch_latency=args.batch_latency, source=source,
+                                      replay_speed=args.replay_speed, features=args.features,
+                                      n_features=args.n_features, verbose=args.verbose)
+
+        # Every prediction is also appended to the binary prediction store
+        store = None
+        if args.store_dir:
+            store = PredictionStore(args.store_dir)
+
+        ctwmGraphPoints = Algorithm(clf_path=args.clf_path_CTWM, name="CTWM", store=store, verbose=args.verbose,
+                                    metrics=captureEngine.metrics, workers=args.inference_workers)
+        whmGraphPoints = Algorithm(clf_path=args.clf_path_WHM, name="WHM", store=store, verbose=args.verbose,
+                                   metrics=captureEngine.metrics, workers=args.inference_workers)
+        if self.show1:
+            captureEngine.register(ctwmGraphPoints)
+        if self.show2:
+            captureEngine.register(whmGraphPoints)
 
         self.secondScreen = UI(showCTWM=self.show1, showWHM=self.show2, showRTLE=self.show3,
-                               algorithmCTWM=ctwmGraphPoints, algorithmWHM=whmGraphPoints,
+                               captureEngine=captureEngine, algorithmCTWM=ctwmGraphPoints,
+                               algorithmWHM=whmGraphPoints,
                                tool_type_text=self.tool_type_text, material_text= self.material_text,
                                flutes_text=self.flutes_num, coating_text=self.coating_text,
                                cutting_type_text=self.cutting_type_text, wpmaterial_text=self.wpmaterial_text,
@@ -1149,12 +1576,57 @@ if __name__ == '__main__':
     parser.add_argument("--clf_path_WHM", help='Classifier path', type=str, default='')
     parser.add_argument("--parent_img_path", help='Parent Directory of display images', type=str, default='')
     parser.add_argument('--window_length', help='Window length used to train Algorithm', type=float, default=0.5)
+    parser.add_argument('--hop_length', help='Seconds between overlapping windows, defaults to window_length',
+                        type=float, default=None)
+    parser.add_argument('--batch_size', help='Windows predicted together in one classifier call', type=int,
+                        default=1)
+    parser.add_argument('--batch_latency', help='Seconds a partial batch may wait before it is predicted', type=float,
+                        default=0.1)
+    parser.add_argument('--features', help='Classifier input, must match the one the models were trained on',
+                        type=str, choices=['spectrum', 'bands', 'logmel'], default='spectrum')
+    parser.add_argument('--n_features', help='Number of bands or mel filters', type=int, default=128)
     parser.add_argument('--rate', help='Sampling rate of audio', type=float, default=44100)
+    parser.add_argument('--history_format', help='Format of the HTW history file', type=str,
+                        choices=[HistoryLogger.TEXT, HistoryLogger.JSON_LINES], default=HistoryLogger.TEXT)
+    parser.add_argument('--plot_points', help='Points visible in the CTWM/WHM graphs before scrolling, defaults to '
+                        '100 and 60', type=int, default=0)
+    parser.add_argument('--long_history', help='Keep the whole session in the CTWM/WHM graphs, zoom with the mouse '
+                        'wheel', action='store_true')
+    parser.add_argument('--fps', help='Frame rate the CTWM/WHM widgets are repainted at', type=float, default=30.)
+    parser.add_argument('--inference_workers', help='Worker processes predicting for each monitor, 0 to predict in '
+                        'the capture thread', type=int, default=0)
+    parser.add_argument('--metrics_interval', help='Seconds between latency reports, 0 for none', type=float,
+                        default=10.)
+    parser.add_argument('--metrics_file', help='File the latency report is exported to, Prometheus text for .prom, '
+                        'appended CSV otherwise', type=str, default='')
+    parser.add_argument('--verbose', help='1 prints the latency reports, 2 also every batch', type=int, default=0)
+    parser.add_argument('--store_dir', help='Directory of the binary prediction store, empty to not store them',
+                        type=str, default='')
+    parser.add_argument('--history_length', help='Seconds of raw audio kept in memory', type=float, default=10.)
+    parser.add_argument('--spill_dir', help='Directory to stream the whole raw capture to (float32)', type=str,
+                        default='')
+    parser.add_argument('--queue_size', help='Audio chunks buffered for the classifier before dropping', type=int,
+                        default=64)
+    parser.add_argument('--drop_policy', help='Chunk to drop when the classifier falls behind', type=str,
+                        choices=[DropQueue.DROP_OLDEST, DropQueue.DROP_NEWEST], default=DropQueue.DROP_OLDEST)
+    parser.add_argument('--input_file', help='Recording (.wav, .npy or raw) to replay instead of the microphone',
+                        type=str, default='')
+    parser.add_argument('--raw_dtype', help='Sample type of raw recordings', type=str, default='int16',
+                        choices=['int16', 'int32', 'float32'])
+    parser.add_argument('--replay_speed', help='Replay speed relative to real time, 0 for as fast as possible',
+                        type=float, default=1.)
+    parser.add_argument('--startup_report', help='Print how long each step of start up took', action='store_true')
     args = parser.parse_args()
 
     app = QApplication(sys.argv)
     dialog = Dialog(args.parent_img_path)
     dialog.show()
+    report.mark("settings dialog")
+
+    # Everything the main window needs loads while the settings are being filled in
+    in_background([("pyqtgraph", pg.load), ("pyaudio", pyaudio.load)] +
+                  [("model " + path, lambda path=path: get_model(path))
+                   for path in (args.clf_path_CTWM, args.clf_path_WHM) if path and os.path.isfile(path)])
 
     app.setWindowIcon(QIcon(os.path.join(args.parent_img_path, "sss_Logo.jpg")))
 
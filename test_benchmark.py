@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+
+from benchmark import StandInClassifier, run, synthetic
+
+
+def test_trained_model_must_match_the_features():
+    audio = synthetic(8000, 1.)
+    # Trained on the full spectrum of 0.05s windows, which has 201 bins at 8 kHz
+    clf = StandInClassifier(201, size=8)
+    with pytest.raises(ValueError):
+        run(audio, 8000, 0.05, None, 1, "bands", 16, 8, 512, clf=clf)
+    result = run(audio, 8000, 0.05, None, 1, "spectrum", 16, 8, 512, clf=clf)
+    assert result['windows'] > 0
+
+
+def test_latency_percentiles_are_ordered():
+    result = run(synthetic(8000, 2.), 8000, 0.05, None, 4, "spectrum", 16, 8, 512)
+    for stage in ("fft", "predict"):
+        values = [result[stage + "_p" + q + "_ms"] for q in ("50", "90", "99")] + [result[stage + "_max_ms"]]
+        assert values == sorted(values)
+        assert np.all(np.isfinite(values))
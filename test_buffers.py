@@ -0,0 +1,68 @@
+import os
+
+import numpy as np
+
+from buffers import AudioHistory, DecimatedSeries
+
+
+def test_every_recording_spills_to_its_own_file(tmpdir):
+    path = str(tmpdir.join("Audio2020-01-01.f32"))
+    first = np.arange(10, dtype=np.float32)
+    history = AudioHistory(100, history_length=0.05, spill_path=path)
+    history.extend(first[:6])
+    history.extend(first[6:])
+    np.testing.assert_array_equal(history.recent(), first[-5:])
+    np.testing.assert_array_equal(history.load(), first)
+    history.close()
+
+    # Recording again, in this run or the next, must not continue the first file
+    second = -np.arange(4, dtype=np.float32)
+    history.extend(second)
+    np.testing.assert_array_equal(history.load(), second)
+    history.close()
+    third = AudioHistory(100, spill_path=path)
+    third.extend(second[:2])
+    third.close()
+
+    assert sorted(os.listdir(str(tmpdir))) == ["Audio2020-01-01-2.f32", "Audio2020-01-01-3.f32",
+                                               "Audio2020-01-01.f32"]
+    np.testing.assert_array_equal(np.fromfile(path, dtype=np.float32), first)
+    np.testing.assert_array_equal(third.load(), second[:2])
+
+
+def test_decimated_series_picks_the_coarsest_level_that_fills_the_view():
+    series = DecimatedSeries(factor=4, capacity=16)
+    x = np.arange(1000, dtype=np.float64)
+    y = np.sin(x / 10.)
+    for xi, yi in zip(x, y):
+        series.append(xi, yi)
+    assert len(series) == 1000
+    assert series.range() == (0., 999.)
+
+    # The whole session on a 100 point view: 1000 points are reduced until at most 100 blocks remain
+    start, stop, level = series.span(0., 999., 100)
+    assert (start, stop, level) == (0, 1000, 2)
+    xs, ys = series.query(0., 999., 100)
+    assert len(xs) <= 4 * 100
+    # Blocks keep the extremes of the points they stand for
+    assert ys.min() == y.min() and ys.max() == y.max()
+
+    # Zoomed in far enough, every point is drawn as it is
+    assert series.span(100., 150., 100)[2] == 0
+    xs, ys = series.query(100., 150., 100)
+    np.testing.assert_array_equal(xs, x[99:152])
+    np.testing.assert_array_equal(ys, y[99:152])
+
+
+def test_decimated_series_spans_tell_when_a_redraw_is_needed():
+    series = DecimatedSeries(factor=4)
+    for xi in range(100):
+        series.append(float(xi), 0.)
+    # Moving the view between the same points does not change what is drawn
+    assert series.span(10.2, 20.2, 100) == series.span(10.8, 20.8, 100)
+    assert series.span(10., 20., 100) != series.span(30., 40., 100)
+    # Following the whole session, only new points change what is drawn
+    drawn = series.span(*series.range() + (100,))
+    assert series.span(*series.range() + (100,)) == drawn
+    series.append(100., 1.)
+    assert series.span(*series.range() + (100,)) != drawn
@@ -0,0 +1,52 @@
+import datetime
+import time
+
+import numpy as np
+
+from history import PredictionStore
+
+
+def day_start(days_ago):
+    day = datetime.date.today() - datetime.timedelta(days=days_ago)
+    return time.mktime(day.timetuple())
+
+
+def test_query_with_interleaved_monitors(tmpdir):
+    store = PredictionStore(str(tmpdir))
+    rng = np.random.RandomState(0)
+    appended = []
+    # Two days of batches from both monitors, handed to the store out of time order, as with batching or workers
+    for start in (day_start(1), day_start(0)):
+        batches = []
+        for monitor in ("CTWM", "WHM"):
+            times = start + 3600. + np.sort(rng.uniform(0., 600., 200))
+            batches += [(monitor, times[i:i + 4]) for i in range(0, times.size, 4)]
+        for index in rng.permutation(len(batches)):
+            monitor, times = batches[index]
+            levels = rng.randint(1, 5, times.size)
+            store.append(monitor, levels, times=times)
+            appended += [(t, monitor, level) for t, level in zip(times, levels)]
+    store.close()
+    assert len(store.files()) == 2
+
+    for _ in range(200):
+        start, end = np.sort(rng.uniform(day_start(1), day_start(0) + 7200., 2))
+        monitor = rng.choice([None, "CTWM", "WHM"])
+        result = store.query(start=start, end=end, monitor=monitor)
+        expected = sorted(t for t, m, _ in appended if start <= t < end and monitor in (None, m))
+        np.testing.assert_array_equal(result['time'], expected)
+
+
+def test_query_keeps_levels_and_confidences(tmpdir):
+    store = PredictionStore(str(tmpdir))
+    now = time.time()
+    store.append("WHM", [3, 4], confidences=[0.5, 0.75], times=[now - 2., now - 1.])
+    store.append("CTWM", [1], times=[now - 3.])
+
+    records = store.query()
+    np.testing.assert_array_equal(records['level'], [1, 3, 4])
+    np.testing.assert_array_equal(records['monitor'], [1, 2, 2])
+    assert np.isnan(records['confidence'][0])
+    np.testing.assert_allclose(records['confidence'][1:], [0.5, 0.75])
+    assert len(store.last(2.5, "WHM")) == 2
+    assert len(store.query(end=now - 3.)) == 0
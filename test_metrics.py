@@ -0,0 +1,36 @@
+import numpy as np
+
+from metrics import Histogram, Metrics
+
+
+def test_percentiles_are_close_to_exact():
+    rng = np.random.RandomState(0)
+    for durations in (rng.uniform(0.004, 0.006, 5000), rng.lognormal(np.log(0.005), 0.5, 5000)):
+        h = Histogram()
+        for seconds in durations:
+            h.record(seconds)
+        for q in (50, 90, 99):
+            np.testing.assert_allclose(h.percentile(q), np.percentile(durations, q), rtol=0.02)
+        np.testing.assert_allclose(h.mean(), durations.mean())
+
+
+def test_percentiles_stay_within_the_recorded_range():
+    h = Histogram()
+    assert h.percentile(50) == 0.
+    for seconds in (0.003, 0.003, 0.003):
+        h.record(seconds)
+    assert h.percentile(0) == h.percentile(100) == 0.003
+    h.record(100.)
+    assert h.percentile(100) == h.max == 100.
+
+
+def test_prometheus_buckets_are_cumulative(tmpdir):
+    metrics = Metrics()
+    for seconds in (1e-4, 2e-3, 2e-3, 0.5):
+        metrics.record("fft", seconds)
+    path = str(tmpdir.join("metrics.prom"))
+    metrics.export(path)
+    with open(path) as f:
+        buckets = [int(line.split()[-1]) for line in f if line.startswith("sss_fft_seconds_bucket")]
+    assert buckets == sorted(buckets)
+    assert buckets[-1] == 4
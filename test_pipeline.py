@@ -0,0 +1,67 @@
+import numpy as np
+
+from buffers import DropQueue
+from pipeline import Pipeline
+
+
+class Recorder(object):
+    def __init__(self):
+        self.spectra = []
+
+    def process(self, spectra):
+        self.spectra.extend(np.array(spectra))
+
+
+class Stamps(object):
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.times = []
+
+    def process(self, spectra):
+        self.times.extend(self.pipeline.times[:len(spectra)])
+
+
+def test_dropped_chunks_do_not_splice_windows():
+    # 10 sample windows fed in 6 sample chunks, so every window spans two chunks
+    pipeline = Pipeline(rate=100, window_length=0.1, batch_size=1, max_latency=float('inf'))
+    recorder = Recorder()
+    pipeline.register(recorder)
+    chunks = [np.random.RandomState(n).randn(6).astype(np.float32) for n in range(5)]
+
+    pipeline.feed(chunks[0], sequence=0)
+    # The consumer falls behind: the queue only holds two chunks, so the first two queued are dropped
+    queue = DropQueue(maxsize=2)
+    for sequence in range(1, 5):
+        queue.put((sequence, chunks[sequence]))
+    assert queue.dropped == 2
+    while len(queue):
+        sequence, chunk = queue.get()
+        pipeline.feed(chunk, sequence=sequence)
+
+    # Only the window after the gap, never chunk 0 joined to chunk 3
+    assert len(recorder.spectra) == 1
+    expected = np.abs(np.fft.rfft(np.concatenate(chunks[3:5])[:10]))
+    np.testing.assert_allclose(recorder.spectra[0], expected, rtol=1e-5)
+
+
+def test_consecutive_chunks_make_windows_across_chunks():
+    pipeline = Pipeline(rate=100, window_length=0.1, batch_size=1, max_latency=float('inf'))
+    recorder = Recorder()
+    pipeline.register(recorder)
+    audio = np.random.RandomState(0).randn(30).astype(np.float32)
+    for sequence, start in enumerate(range(0, audio.size, 6)):
+        pipeline.feed(audio[start:start + 6], sequence=sequence)
+
+    assert len(recorder.spectra) == 3
+    for n, spectrum in enumerate(recorder.spectra):
+        np.testing.assert_allclose(spectrum, np.abs(np.fft.rfft(audio[10 * n:10 * (n + 1)])), rtol=1e-5)
+
+
+def test_windows_carry_their_capture_time():
+    pipeline = Pipeline(rate=100, window_length=0.1, batch_size=2, max_latency=float('inf'))
+    stamps = Stamps(pipeline)
+    pipeline.register(stamps)
+    # Chunk of 0.25s captured up to t=1000: windows end 0.15s and 0.05s before its end
+    pipeline.feed(np.zeros(25, dtype=np.float32), timestamp=1000.)
+
+    np.testing.assert_allclose(stamps.times, [999.85, 999.95])
@@ -0,0 +1,94 @@
+import os
+import struct
+
+import numpy as np
+import pytest
+
+from pipeline import Pipeline
+from sources import (WAVE_FORMAT_EXTENSIBLE, WAVE_FORMAT_IEEE_FLOAT, WAVE_FORMAT_PCM, FileSource, read_wav_header,
+                     replay)
+
+
+def write_wav(path, samples, rate, tag, extra=b"", extensible=False):
+    """
+    Minimal WAV writer, so every format can be tested without depending on what the wave module supports
+    """
+    samples = np.asarray(samples)
+    channels = 1 if samples.ndim == 1 else samples.shape[1]
+    bits = samples.dtype.itemsize * 8
+    block_align = channels * samples.dtype.itemsize
+    fmt = struct.pack("<HHIIHH", WAVE_FORMAT_EXTENSIBLE if extensible else tag, channels, rate, rate * block_align,
+                      block_align, bits)
+    if extensible:
+        # Valid bits, channel mask, then the sub format GUID starting with the real tag
+        fmt += struct.pack("<HHI", 22, bits, 0) + struct.pack("<H", tag) + b"\x00\x00\x00\x00\x10\x00\x80\x00" \
+            b"\x00\xaa\x00\x38\x9b\x71"
+    data = samples.astype(samples.dtype.newbyteorder("<")).tobytes()
+    body = b"WAVE" + b"fmt " + struct.pack("<I", len(fmt)) + fmt + extra
+    body += b"data" + struct.pack("<I", len(data)) + data
+    with open(path, "wb") as f:
+        f.write(b"RIFF" + struct.pack("<I", len(body)) + body)
+
+
+@pytest.mark.parametrize("dtype, tag, extensible", [
+    (np.uint8, WAVE_FORMAT_PCM, False),
+    (np.int16, WAVE_FORMAT_PCM, False),
+    (np.int32, WAVE_FORMAT_PCM, False),
+    (np.float32, WAVE_FORMAT_IEEE_FLOAT, False),
+    (np.float64, WAVE_FORMAT_IEEE_FLOAT, False),
+    (np.int16, WAVE_FORMAT_PCM, True),
+    (np.float32, WAVE_FORMAT_IEEE_FLOAT, True),
+])
+def test_wav_formats(tmpdir, dtype, tag, extensible):
+    path = str(tmpdir.join("tone.wav"))
+    samples = (np.arange(30).reshape(15, 2) % 7).astype(dtype)
+    write_wav(path, samples, 16000, tag, extensible=extensible)
+
+    rate, channels, sample_dtype, offset, frames = read_wav_header(path)
+    assert (rate, channels, frames) == (16000, 2, 15)
+    assert sample_dtype == np.dtype(dtype)
+    source = FileSource(path, chunk_size=4)
+    np.testing.assert_array_equal(source.samples, samples)
+    assert source.rate == 16000
+
+
+def test_wav_skips_odd_sized_chunks_and_truncated_data(tmpdir):
+    path = str(tmpdir.join("tagged.wav"))
+    # A LIST chunk of odd size is padded to an even one
+    samples = np.arange(10, dtype=np.int16)
+    write_wav(path, samples, 8000, WAVE_FORMAT_PCM, extra=b"LIST" + struct.pack("<I", 3) + b"abc\x00")
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 4)
+
+    rate, channels, sample_dtype, offset, frames = read_wav_header(path)
+    assert (rate, channels, frames) == (8000, 1, 8)
+    np.testing.assert_array_equal(FileSource(path).samples[:, 0], samples[:8])
+
+
+def test_wav_rejects_other_files(tmpdir):
+    path = str(tmpdir.join("text.wav"))
+    with open(path, "wb") as f:
+        f.write(b"not a recording at all")
+    with pytest.raises(ValueError):
+        read_wav_header(path)
+    write_wav(path, np.zeros(4, dtype=np.int16), 8000, 2)
+    with pytest.raises(ValueError):
+        read_wav_header(path)
+
+
+def test_chunks_are_mono_float32(tmpdir):
+    path = str(tmpdir.join("stereo.wav"))
+    write_wav(path, np.array([[16384, -16384], [32767, 32767], [0, -32768]], dtype=np.int16), 8000,
+              WAVE_FORMAT_PCM)
+    chunks = list(FileSource(path, chunk_size=2).chunks())
+    assert [chunk.dtype for chunk in chunks] == [np.float32, np.float32]
+    np.testing.assert_allclose(np.concatenate(chunks), [0., 32767 / 32768., -0.5])
+
+
+def test_replay_needs_the_rate_of_the_recording(tmpdir):
+    path = str(tmpdir.join("tone.wav"))
+    write_wav(path, np.zeros(1600, dtype=np.int16), 16000, WAVE_FORMAT_PCM)
+    source = FileSource(path)
+    with pytest.raises(ValueError):
+        replay(source, Pipeline(rate=8000, window_length=0.05, max_latency=float('inf')))
+    assert replay(source, Pipeline(rate=source.rate, window_length=0.05, max_latency=float('inf'))) == 2
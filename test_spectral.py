@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from spectral import BandEnergies, LogMel, get_plan, make_features
+
+
+@pytest.mark.parametrize("kind", ["bands", "logmel"])
+def test_feature_shapes(kind):
+    plan = get_plan(8000, 400)
+    features = make_features(kind, plan, 16)
+    magnitude = np.abs(np.random.RandomState(0).randn(5, plan.bins))
+    assert features.transform(magnitude[0]).shape == (16,)
+    out = np.empty((5, 16))
+    assert features.transform(magnitude, out=out) is out
+    np.testing.assert_allclose(out[2], features.transform(magnitude[2]))
+    assert features.config()['kind'] == kind
+
+
+def test_band_energies_sum_the_bands():
+    plan = get_plan(8000, 400)
+    bands = BandEnergies(plan, 4)
+    magnitude = np.ones(plan.bins)
+    # 200 of the 201 bins below Nyquist, split in four bands of 50, and the Nyquist bin goes with the last
+    np.testing.assert_allclose(bands.transform(magnitude), np.log10([50., 50., 50., 51.]))
+
+
+def test_log_mel_puts_a_tone_in_its_filter():
+    plan = get_plan(8000, 400)
+    mel = LogMel(plan, 16)
+    tone = np.abs(np.fft.rfft(np.sin(2 * np.pi * 1000. * np.arange(400) / 8000.)))
+    features = mel.transform(tone)
+    peak = int(np.argmax(features))
+    hz = LogMel.mel_to_hz(np.linspace(LogMel.hz_to_mel(0.), LogMel.hz_to_mel(4000.), 18))
+    assert hz[peak] < 1000. < hz[peak + 2]
+
+
+@pytest.mark.parametrize("settings", [dict(fmin=1000., fmax=1000.), dict(fmax=5000.), dict(fmin=-1.), dict(size=0),
+                                      dict(size=200)])
+def test_log_mel_rejects_bad_settings(settings):
+    with pytest.raises(ValueError):
+        LogMel(get_plan(8000, 400), **settings)
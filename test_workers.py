@@ -0,0 +1,89 @@
+import time
+
+import numpy as np
+import pytest
+
+from workers import InferencePool, predicted_probability
+
+
+class EchoClassifier(object):
+    """
+    Predicts the first column of each row, the slower the smaller it is, so later batches often finish first
+    """
+    classes_ = np.array([1, 2, 3, 4])
+
+    def predict(self, X):
+        time.sleep(0.02 * (4 - X[0, 0]))
+        return X[:, 0].astype(int)
+
+    def predict_proba(self, X):
+        proba = np.full((len(X), 4), 0.1)
+        proba[np.arange(len(X)), X[:, 0].astype(int) - 1] = 0.7
+        return proba
+
+
+class BrokenProbabilities(EchoClassifier):
+    def predict_proba(self, X):
+        raise IndexError("no probabilities today")
+
+
+class UnknownClasses(EchoClassifier):
+    classes_ = np.array([1, 2])
+
+
+class BrokenPredictions(EchoClassifier):
+    def predict(self, X):
+        raise RuntimeError("cannot predict")
+
+
+def loader(path, mmap_mode):
+    return dict(echo=EchoClassifier, broken_proba=BrokenProbabilities, unknown=UnknownClasses,
+                broken=BrokenPredictions)[path]()
+
+
+def predict_all(path, levels):
+    results = []
+    pool = InferencePool(path, 3, 2, lambda *result: results.append(result), processes=2, confidence=True,
+                         loader=loader)
+    try:
+        for level in levels:
+            pool.submit(np.full((2, 3), float(level)))
+    finally:
+        pool.close()
+    return results
+
+
+def test_results_come_back_in_submission_order():
+    levels = [1, 2, 3, 4, 1, 4, 2, 3]
+    results = predict_all("echo", levels)
+    assert [int(pred[0]) for pred, confidences, error in results] == levels
+    for pred, confidences, error in results:
+        assert error is None
+        np.testing.assert_allclose(confidences, [0.7, 0.7])
+
+
+def test_predictions_survive_failing_probabilities():
+    # Either predict_proba fails, or the predictions are not among the model's classes
+    for path in ("broken_proba", "unknown"):
+        results = predict_all(path, [3, 4])
+        assert [int(pred[0]) for pred, confidences, error in results] == [3, 4]
+        assert all(confidences is None and error is None for pred, confidences, error in results)
+
+
+def test_failed_predictions_are_reported():
+    results = predict_all("broken", [1, 2])
+    assert [(pred, error) for pred, confidences, error in results] == [(None, "cannot predict")] * 2
+
+
+def test_submit_after_close_fails():
+    pool = InferencePool("echo", 3, 2, lambda *result: None, loader=loader)
+    pool.close()
+    with pytest.raises(ValueError):
+        pool.submit(np.ones((1, 3)))
+
+
+def test_probability_of_the_predicted_class():
+    clf = EchoClassifier()
+    spectra = np.array([[2., 0., 0.], [4., 0., 0.]])
+    np.testing.assert_allclose(predicted_probability(clf, spectra, np.array([2, 1])), [0.7, 0.1])
+    assert predicted_probability(clf, spectra, np.array([2, 5])) is None
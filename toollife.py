@@ -0,0 +1,89 @@
+from collections import OrderedDict
+
+import numpy as np
+
+
+def cutting_speed(diameter, rpm):
+    """
+    Cutting speed. Works on scalars and on arrays, which broadcast against each other
+    :param diameter: The radial DOC in inches
+    :param rpm: Speed
+    :return: V: cutting speed in ft/min
+    """
+    return np.pi * np.asarray(diameter, dtype=np.float64) * rpm / 12.
+
+
+def tool_life(V, d, f, rpm, flute):
+    """
+    Remaining tool life from the Taylor-style tool life equation. Works on scalars and on arrays, which broadcast
+    against each other
+    :param V: Cutting speed in ft/min
+    :param d: Depth of cut in in
+    :param f: Feed rate in in/min
+    :param rpm: Speed
+    :param flute: Number of flutes
+    :return: Tool life in minutes
+    """
+    V = np.asarray(V, dtype=np.float64)
+    chip_load = np.asarray(f, dtype=np.float64) / (np.asarray(rpm, dtype=np.float64) * flute) * 25.4
+    return 100. ** (1 / 0.15) * V ** (-1 / 0.15) / (np.asarray(d, dtype=np.float64) * 25.4) * \
+        chip_load ** (-0.1 / 0.15)
+
+
+class WhatIfEngine(object):
+    """
+    Tool life over whole grids of speed, feed and depth, evaluated in one NumPy pass. Grids are cached per tool
+    configuration, so going back to an earlier sweep costs nothing
+    """
+    def __init__(self, cache_size=16):
+        """
+        Initialize the engine
+        :param cache_size: Number of grids kept
+        """
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+    @staticmethod
+    def axis(values):
+        """
+        Values of one grid axis
+        :param values: A single value, or (lowest, highest, count) for count evenly spaced values
+        :return: 1D array
+        """
+        if np.isscalar(values):
+            return np.array([float(values)])
+        low, high, count = values
+        return np.linspace(float(low), float(high), int(count))
+
+    def grid(self, flute, rpm, feed, depth):
+        """
+        Tool life of every combination
+        :param flute: Number of flutes of the tool
+        :param rpm: Speed, a value or (lowest, highest, count)
+        :param feed: Feed rate in in/min, a value or (lowest, highest, count)
+        :param depth: Radial DOC in in, a value or (lowest, highest, count)
+        :return: (rpm values, feed values, depth values, (rpms, feeds, depths) array of tool life in minutes). The
+        arrays are shared with the cache, do not modify them
+        """
+        key = (float(flute), rpm, feed, depth)
+        result = self.cache.get(key)
+        if result is not None:
+            # Most recently used last
+            del self.cache[key]
+            self.cache[key] = result
+            return result
+        rpms, feeds, depths = self.axis(rpm), self.axis(feed), self.axis(depth)
+        # Broadcast to (rpms, feeds, depths) instead of looping over the combinations
+        R = rpms[:, np.newaxis, np.newaxis]
+        F = feeds[np.newaxis, :, np.newaxis]
+        D = depths[np.newaxis, np.newaxis, :]
+        # Like the single estimate, the cutting speed is taken at the radial DOC
+        with np.errstate(divide="ignore", invalid="ignore"):
+            life = tool_life(cutting_speed(D, R), D, F, R, flute)
+        for array in (rpms, feeds, depths, life):
+            array.setflags(write=False)
+        result = (rpms, feeds, depths, life)
+        self.cache[key] = result
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return result
@@ -0,0 +1,119 @@
+import argparse
+import os
+import sys
+
+import numpy as np
+from sklearn.externals import joblib
+from sklearn.model_selection import train_test_split
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+from sklearn.svm import SVC
+
+from pipeline import Pipeline
+from score import find_recordings
+from sources import FileSource, replay
+
+
+class Collector(object):
+    """
+    Monitor that keeps the features of every window
+    """
+    def __init__(self):
+        self.features = []
+
+    def process(self, spectra):
+        """
+        Keep a batch of windows
+        :param spectra: (windows, width) array, reused by the pipeline so it is copied
+        :return: None
+        """
+        self.features.append(spectra.copy())
+
+
+def extract(path, args):
+    """
+    Features of every window of a recording, computed exactly like the live pipeline computes them
+    :param path: Path of the recording
+    :param args: Parsed command line arguments
+    :return: ((windows, width) array, feature settings)
+    """
+    source = FileSource(path, rate=args.rate, dtype=args.raw_dtype)
+    pipeline = Pipeline(rate=source.rate, window_length=args.window_length, hop_length=args.hop_length,
+                        batch_size=256, max_latency=float('inf'), features=args.features, n_features=args.n_features)
+    collector = Collector()
+    pipeline.register(collector)
+    replay(source, pipeline)
+    if not collector.features:
+        return np.zeros((0, pipeline.batch.shape[1])), pipeline.feature_config()
+    return np.concatenate(collector.features), pipeline.feature_config()
+
+
+def main(args):
+    """
+    Train a classifier on labelled recordings and export it for temp_gui.py and score.py
+    :param args: Parsed command line arguments
+    :return: int: Exit code
+    """
+    # Every subdirectory is a class, named by its prediction number (1 = Good ... 4 = Failure)
+    labels = [label for label in sorted(os.listdir(args.input_dir))
+              if os.path.isdir(os.path.join(args.input_dir, label))]
+    # Checked before any recording is read, extracting features can take a while
+    for label in labels:
+        try:
+            int(label)
+        except ValueError:
+            print("Class directory " + os.path.join(args.input_dir, label) + " is not named by a prediction number "
+                  "(1, 2, 3, 4)")
+            return 1
+    X, y = [], []
+    config = None
+    for label in labels:
+        directory = os.path.join(args.input_dir, label)
+        for path in find_recordings(directory, args.extensions.split(",")):
+            features, config = extract(path, args)
+            X.append(features)
+            y.append(np.full(len(features), int(label), dtype=np.int16))
+            print("Extracted " + str(len(features)) + " windows of class " + label + " from " + path)
+    if not X:
+        print("No recordings found in the class directories of " + args.input_dir)
+        return 1
+    X = np.concatenate(X)
+    y = np.concatenate(y)
+
+    def model():
+        return make_pipeline(StandardScaler(), SVC(C=args.C, kernel=args.kernel))
+
+    if args.test_size > 0:
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=args.test_size, stratify=y)
+        accuracy = model().fit(X_train, y_train).score(X_test, y_test)
+        print("Held out accuracy: {:0.3f} on {} windows".format(accuracy, len(y_test)))
+
+    clf = model().fit(X, y)
+    # The live pipeline refuses a model whose features differ from the ones it computes
+    clf.features_ = config
+    joblib.dump(clf, args.output)
+    print("Saved model trained on " + str(len(y)) + " windows of " + str(X.shape[1]) + " features to " + args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Train a Smart Sensing System model on labelled recordings')
+    parser.add_argument("input_dir", help='Directory with one subdirectory of recordings per class (1, 2, 3, 4)',
+                        type=str)
+    parser.add_argument("--output", help='Path of the PKL file to write', type=str, default='model.pkl')
+    parser.add_argument('--window_length', help='Window length of the Algorithm', type=float, default=0.5)
+    parser.add_argument('--hop_length', help='Seconds between overlapping windows, defaults to window_length',
+                        type=float, default=None)
+    parser.add_argument('--features', help='Classifier input', type=str, choices=['spectrum', 'bands', 'logmel'],
+                        default='logmel')
+    parser.add_argument('--n_features', help='Number of bands or mel filters', type=int, default=128)
+    parser.add_argument('--rate', help='Sampling rate of .npy and raw recordings', type=float, default=44100)
+    parser.add_argument('--raw_dtype', help='Sample type of raw recordings', type=str, default='int16',
+                        choices=['int16', 'int32', 'float32'])
+    parser.add_argument('--extensions', help='Comma separated extensions of the recordings', type=str,
+                        default='wav,npy,raw')
+    parser.add_argument('--C', help='SVM regularization', type=float, default=1.)
+    parser.add_argument('--kernel', help='SVM kernel', type=str, default='rbf')
+    parser.add_argument('--test_size', help='Fraction of windows held out to report accuracy, 0 to skip',
+                        type=float, default=0.2)
+    sys.exit(main(parser.parse_args()))
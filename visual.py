@@ -1,18 +1,186 @@
 from OpenGL.GLUT import *
 from OpenGL.GLU import *
 from OpenGL.GL import *
+import argparse
 import sys
-import math
+import threading
+import time
 
 import pyaudio
-import wave
 import numpy as np
 
+from buffers import DoubleBuffer
+from metrics import Histogram, clock
+from sources import FileSource
+from spectral import get_plan
+
+
+def sphere_mesh(radius, slices, stacks):
+    """
+    Triangles of a sphere, counter-clockwise seen from outside like glutSolidSphere
+    :param radius: Radius of the sphere
+    :param slices: Subdivisions around the vertical axis
+    :param stacks: Subdivisions along the vertical axis
+    :return: (vertices, normals, indices) as float32 (n, 3), float32 (n, 3) and uint32 (triangles * 3,) arrays
+    """
+    phi = np.linspace(0., np.pi, stacks + 1)[:, np.newaxis]  # from the top down
+    theta = np.linspace(0., 2 * np.pi, slices + 1)[np.newaxis, :]
+    normals = np.stack([np.sin(phi) * np.cos(theta), np.cos(phi) * np.ones_like(theta),
+                        -np.sin(phi) * np.sin(theta)], axis=-1).reshape(-1, 3).astype(np.float32)
+    # Two triangles per quad of the grid
+    top = (np.arange(stacks)[:, np.newaxis] * (slices + 1) + np.arange(slices)[np.newaxis, :]).ravel()
+    bottom = top + slices + 1
+    indices = np.stack([top, bottom, top + 1, top + 1, bottom, bottom + 1], axis=-1).ravel().astype(np.uint32)
+    return normals * radius, normals, indices
+
+
+class SphereBatch:
+    """
+    Draws many spheres of the same mesh. The mesh is uploaded once, each frame only the per sphere positions and
+    colors in NumPy arrays are uploaded and one glDrawElementsInstanced call draws every sphere. The small shader
+    does the lighting that Visual.lighting sets up for the fixed function pipeline. Drivers without instancing, or
+    without GLSL 1.20, draw the same static mesh once per sphere instead
+    """
+
+    VERTEX_SHADER = """
+    #version 120
+    attribute vec3 position;
+    attribute vec3 normal;
+    attribute vec3 offset;
+    attribute vec4 color;
+    varying vec4 shade;
+    void main() {
+        // light 0 and the color as diffuse material, like the fixed function lighting
+        vec3 light = normalize(gl_LightSource[0].position.xyz);
+        float diffuse = max(dot(normalize(gl_NormalMatrix * normal), light), 0.);
+        shade = vec4(gl_LightModel.ambient.rgb * gl_FrontMaterial.ambient.rgb +
+                     color.rgb * gl_LightSource[0].diffuse.rgb * diffuse, color.a);
+        gl_Position = gl_ModelViewProjectionMatrix * vec4(position + offset, 1.);
+    }
+    """
+
+    FRAGMENT_SHADER = """
+    #version 120
+    varying vec4 shade;
+    void main() {
+        gl_FragColor = shade;
+    }
+    """
+
+    def __init__(self, count, radius=2., slices=10, stacks=10):
+        # Needs a current GL context
+        mesh, normals, indices = sphere_mesh(radius, slices, stacks)
+        self.count = count
+        self.index_count = indices.size
+        # Set these, draw uploads them
+        self.positions = np.zeros((count, 3), dtype=np.float32)
+        self.colors = np.tile(np.array([1., 0., 0., 1.], dtype=np.float32), (count, 1))  # red atm
+
+        # the mesh never changes, so it is uploaded here and only here
+        self.vertex_buffer, self.normal_buffer, self.index_buffer, self.offset_buffer, self.color_buffer = \
+            glGenBuffers(5)
+        glBindBuffer(GL_ARRAY_BUFFER, self.vertex_buffer)
+        glBufferData(GL_ARRAY_BUFFER, mesh.nbytes, mesh, GL_STATIC_DRAW)
+        glBindBuffer(GL_ARRAY_BUFFER, self.normal_buffer)
+        glBufferData(GL_ARRAY_BUFFER, normals.nbytes, normals, GL_STATIC_DRAW)
+        glBindBuffer(GL_ARRAY_BUFFER, self.offset_buffer)
+        glBufferData(GL_ARRAY_BUFFER, self.positions.nbytes, None, GL_STREAM_DRAW)
+        glBindBuffer(GL_ARRAY_BUFFER, self.color_buffer)
+        glBufferData(GL_ARRAY_BUFFER, self.colors.nbytes, None, GL_STREAM_DRAW)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.index_buffer)
+        glBufferData(GL_ELEMENT_ARRAY_BUFFER, indices.nbytes, indices, GL_STATIC_DRAW)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
+
+        self.program = None
+        if bool(glDrawElementsInstanced) and bool(glVertexAttribDivisor):
+            try:
+                self.program = self.link()
+            except Exception as e:  # no GLSL 1.20, or the driver rejects the shader
+                print("Drawing the balls one by one, instancing is not available: " + str(e))
+
+    def link(self):
+        from OpenGL.GL import shaders
+        program = glCreateProgram()
+        glAttachShader(program, shaders.compileShader(self.VERTEX_SHADER, GL_VERTEX_SHADER))
+        glAttachShader(program, shaders.compileShader(self.FRAGMENT_SHADER, GL_FRAGMENT_SHADER))
+        # attribute 0 stands in for gl_Vertex, some drivers draw nothing unless it is an enabled array
+        glBindAttribLocation(program, 0, "position")
+        glLinkProgram(program)
+        if not glGetProgramiv(program, GL_LINK_STATUS):
+            raise RuntimeError(glGetProgramInfoLog(program))
+        # (location, components, divisor, buffer) of each attribute
+        self.attributes = [(glGetAttribLocation(program, name), size, divisor, buffer)
+                           for name, size, divisor, buffer in (("position", 3, 0, self.vertex_buffer),
+                                                               ("normal", 3, 0, self.normal_buffer),
+                                                               ("offset", 3, 1, self.offset_buffer),
+                                                               ("color", 4, 1, self.color_buffer))]
+        return program
+
+    def draw(self):
+        if self.program is None:
+            self.draw_each()
+            return
+        # the only upload of the frame: one position and one color per sphere
+        glBindBuffer(GL_ARRAY_BUFFER, self.offset_buffer)
+        glBufferSubData(GL_ARRAY_BUFFER, 0, self.positions.nbytes, self.positions)
+        glBindBuffer(GL_ARRAY_BUFFER, self.color_buffer)
+        glBufferSubData(GL_ARRAY_BUFFER, 0, self.colors.nbytes, self.colors)
+
+        glUseProgram(self.program)
+        for location, size, divisor, buffer in self.attributes:
+            if location < 0:
+                continue  # optimized away
+            glBindBuffer(GL_ARRAY_BUFFER, buffer)
+            glVertexAttribPointer(location, size, GL_FLOAT, GL_FALSE, 0, None)
+            glVertexAttribDivisor(location, divisor)  # 1: advances once per sphere instead of once per vertex
+            glEnableVertexAttribArray(location)
+
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.index_buffer)
+        glDrawElementsInstanced(GL_TRIANGLES, self.index_count, GL_UNSIGNED_INT, None, self.count)
+
+        for location, size, divisor, buffer in self.attributes:
+            if location >= 0:
+                glDisableVertexAttribArray(location)
+                glVertexAttribDivisor(location, 0)
+        glUseProgram(0)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def draw_each(self):
+        # fallback: the same static mesh, moved and colored per sphere with the fixed function pipeline
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_NORMAL_ARRAY)
+        glBindBuffer(GL_ARRAY_BUFFER, self.vertex_buffer)
+        glVertexPointer(3, GL_FLOAT, 0, None)
+        glBindBuffer(GL_ARRAY_BUFFER, self.normal_buffer)
+        glNormalPointer(GL_FLOAT, 0, None)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.index_buffer)
+
+        glMatrixMode(GL_MODELVIEW)
+        for position, color in zip(self.positions, self.colors):
+            glPushMatrix()
+            glTranslatef(*position)
+            glColor4fv(color)
+            glDrawElements(GL_TRIANGLES, self.index_count, GL_UNSIGNED_INT, None)
+            glPopMatrix()
+
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        glDisableClientState(GL_NORMAL_ARRAY)
+        glDisableClientState(GL_VERTEX_ARRAY)
+
 
 class Visual:
 
-    def __init__(self):
+    def __init__(self, fps=60., speed=30., stats_interval=5., spectrum=None, bins=None, gain=8.):
         self.name = "Vizualizer Test"
+        self.spectrum = spectrum  # DoubleBuffer the capture thread publishes the magnitude spectrum in, None for sines
+        self.bins = bins  # spectrum bin of each ball
+        self.gain = gain  # height per decade of magnitude
+        self.fps = fps  # frames are scheduled with glutTimerFunc at this rate
+        self.speed = speed  # animation steps per second, whatever the frame rate
+        self.stats_interval = stats_interval  # seconds between frame statistics, 0 for none
 
     def initbg(self):
         glutInit(sys.argv)
@@ -49,43 +217,86 @@ class Visual:
         glLightf(GL_LIGHT0, GL_LINEAR_ATTENUATION, 0.05)
         glEnable(GL_LIGHT0)
 
+        # the current color is the diffuse material, so each ball can have its own
+        glColorMaterial(GL_FRONT, GL_DIFFUSE)
+        glEnable(GL_COLOR_MATERIAL)
 
 
-    def draw_ball(self,x,y,z):
-        #(radius,slices,stacks)
-        x1 = x/5
-        #print(x1)
-        if x1==0:
-            glTranslatef(x, math.sin(y)*10, z)
 
-        else:
-            glTranslatef(x, math.sin(.166*y)*10, z)
-        glutSolidSphere(2, 10, 10)
+    def place_balls(self, y):
+        if self.spectrum is not None and self.spectrum.version > 0:
+            # every ball's bin from the latest spectrum, no lock and no copy of the spectrum
+            level = np.log10(1. + self.spectrum.take(self.bins)) * self.gain
+            self.balls.positions[:, 1] = np.minimum(level, 20.) - 10.
+            # red when quiet to yellow when loud
+            self.balls.colors[:, 1] = np.minimum(level / 20., 1.)
+            return
+        x = self.balls.positions[:, 0]
+        # the ball in the middle moves faster
+        self.balls.positions[:, 1] = np.where(x == 0, np.sin(y), np.sin(.166*y))*10
 
     def display(self):
-        for j in range(100):
-            #clear
-            glClear(GL_COLOR_BUFFER_BIT|GL_DEPTH_BUFFER_BIT)
-
-            for i in range(-100,100,5):  #(-100,100,5)
-                glPushMatrix()
-                color = [1.0,0.,0.,1.] #red atm
-                #(face, pname, param)
-                glMaterialfv(GL_FRONT,GL_DIFFUSE,color)
-                self.draw_ball(i,j,0)
-                glPopMatrix()
-
-            glFlush()
-            glutSwapBuffers()
-            glutPostRedisplay()
+        start = clock()
+        if self.last_frame is not None:
+            self.intervals.record(start - self.last_frame)
+        self.last_frame = start
+
+        #clear
+        glClear(GL_COLOR_BUFFER_BIT|GL_DEPTH_BUFFER_BIT)
+
+        # position from the time since the start, not from the number of frames drawn
+        self.place_balls((start - self.start) * self.speed)
+        self.balls.draw()
+
+        glFlush()
+        glutSwapBuffers()
+        self.render_times.record(clock() - start)
+
+        if self.stats_interval and start - self.stats_start >= self.stats_interval:
+            self.print_stats(start)
+
+    def tick(self, value):
+        # ask for one frame and schedule the next on a fixed grid, so slow frames do not shift the ones after them
+        glutPostRedisplay()
+        period = 1. / self.fps
+        now = clock()
+        self.next_frame += period
+        if self.next_frame < now:
+            # too far behind to catch up, skip the missed frames
+            self.next_frame = now + period
+        glutTimerFunc(int((self.next_frame - now) * 1000), self.tick, 0)
+
+    def print_stats(self, now):
+        frames = self.intervals.count
+        print("{:0.1f} fps (target {:g}) | frame interval p50 {:0.1f}ms p99 {:0.1f}ms max {:0.1f}ms | "
+              "render p50 {:0.2f}ms p99 {:0.2f}ms".format(
+                  frames / (now - self.stats_start), self.fps, self.intervals.percentile(50) * 1000.,
+                  self.intervals.percentile(99) * 1000., self.intervals.max * 1000.,
+                  self.render_times.percentile(50) * 1000., self.render_times.percentile(99) * 1000.))
+        self.intervals = Histogram()
+        self.render_times = Histogram()
+        self.stats_start = now
 
 
     def visualmain(self):
 
         self.initbg()
         self.lighting()
+
+        # one ball every 5 units from -100 to 100, radius 2 (slices, stacks 10), all drawn together
+        xs = np.arange(-100, 100, 5)
+        self.balls = SphereBatch(len(xs), radius=2, slices=10, stacks=10)
+        self.balls.positions[:, 0] = xs
+
         glutDisplayFunc(self.display)
 
+        # frame pacing and statistics
+        self.start = self.stats_start = self.next_frame = clock()
+        self.last_frame = None
+        self.intervals = Histogram()
+        self.render_times = Histogram()
+        glutTimerFunc(0, self.tick, 0)
+
         #distance
         gluPerspective(100.,1.,1.,400.)
         glMatrixMode(GL_MODELVIEW)
@@ -96,11 +307,22 @@ class Visual:
 
 class Audio:
 
-    def audiomain(self):
+    CHUNK = 4096  # number of data points to read at a time
+    RATE = 44100  # time resolution of the recording device (Hz)
+    TARGET = 440  # show only this one frequency
+
+    def audiomain(self, path=None):
 
-        CHUNK = 4096  # number of data points to read at a time
-        RATE = 44100  # time resolution of the recording device (Hz)
-        TARGET = 440  # show only this one frequency
+        CHUNK, RATE, TARGET = self.CHUNK, self.RATE, self.TARGET
+
+        if path is not None:
+            # read a recording instead of the microphone, a chunk at a time and as fast as possible
+            source = FileSource(path, rate=RATE, chunk_size=CHUNK)
+            for chunk in source.chunks():
+                if chunk.size < CHUNK:
+                    break
+                self.show(chunk * 32768., source.rate, TARGET)  # same scale as the int16 stream, at the file's rate
+            return
 
         p = pyaudio.PyAudio()  # start the PyAudio class
         stream = p.open(format=pyaudio.paInt16, channels=1, rate=RATE, input=True,
@@ -109,24 +331,80 @@ class Audio:
         # create a numpy array holding a single read of audio data
         for i in range(30):  # to it a few times just to see
             data = np.fromstring(stream.read(CHUNK), dtype=np.int16)
-            fft = abs(np.fft.fft(data).real)
-            fft = fft[:int(len(fft) / 2)]  # keep only first half
-            freq = np.fft.fftfreq(CHUNK, 1.0 / RATE)
-            freq = freq[:int(len(freq) / 2)]  # keep only first half
-            assert freq[-1] > TARGET, "ERROR: increase chunk size"
-            val = fft[np.where(freq >= TARGET)[0][0]]
-            print(val)
+            self.show(data, RATE, TARGET)
 
         # close the stream gracefully
         stream.stop_stream()
         stream.close()
         p.terminate()
 
-
-
-def main():
-    #Visual().visualmain()
-    Audio().audiomain()
-
-main()
-
+    def stream(self, spectrum, source=None):
+        # capture thread: publish the magnitude spectrum of every chunk for the visualizer, until the process exits
+        if source is not None:
+            # replay a FileSource of CHUNK frames at its real speed, with the bins of its own rate
+            plan = get_plan(source.rate, self.CHUNK)
+            start = time.time()
+            for i, chunk in enumerate(source.chunks()):
+                if chunk.size < self.CHUNK:
+                    break
+                plan.magnitude(chunk, out=spectrum.back())
+                spectrum.publish()
+                time.sleep(max(0., start + (i + 1) * self.CHUNK / float(source.rate) - time.time()))
+            return
+
+        plan = get_plan(self.RATE, self.CHUNK)
+        p = pyaudio.PyAudio()
+        stream = p.open(format=pyaudio.paInt16, channels=1, rate=self.RATE, input=True, frames_per_buffer=self.CHUNK)
+        samples = np.empty(self.CHUNK, dtype=np.float32)
+        while True:
+            # same scale as a recording, the spectrum is written straight into the back buffer
+            np.multiply(np.frombuffer(stream.read(self.CHUNK, exception_on_overflow=False), dtype=np.int16),
+                        1. / 32768, out=samples)
+            plan.magnitude(samples, out=spectrum.back())
+            spectrum.publish()
+
+    def show(self, data, rate, target):
+        plan = get_plan(rate, len(data))  # bin table is only built on the first read
+        fft = plan.transform(data)  # real input, so only the first half is computed
+        val = abs(fft[plan.bin(target)].real)
+        print(val)
+
+
+
+def main(args):
+    """
+    Show the visualizer, or print the target frequency of a few chunks
+    :param args: Parsed command line arguments
+    :return: None
+    """
+    path = args.recording or None  # replay a recording instead of the microphone
+    if args.print_target:
+        # print the target frequency of a few chunks, no window
+        Audio().audiomain(path)
+        return
+
+    # live mode: the capture thread publishes spectra, the render loop shows the latest one at its own frame rate
+    audio = Audio()
+    # a recording is shown at its own rate, so the balls stay on the same frequencies
+    source = None if path is None else FileSource(path, rate=audio.RATE, chunk_size=audio.CHUNK)
+    plan = get_plan(audio.RATE if source is None else source.rate, audio.CHUNK)
+    spectrum = DoubleBuffer(plan.bins)
+    # one ball every 5 units from -100 to 100, each on a log spaced frequency from 60 Hz to 8 kHz
+    bins = np.searchsorted(plan.freq, np.geomspace(60., 8000., len(range(-100, 100, 5))))
+    capture = threading.Thread(target=audio.stream, args=(spectrum, source), name="Capture")
+    capture.daemon = True
+    capture.start()
+    Visual(fps=args.fps, stats_interval=args.stats_interval, spectrum=spectrum, bins=bins,
+           gain=args.gain).visualmain()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Show the spectrum of the microphone or a recording as balls')
+    parser.add_argument('recording', help='Recording (.wav, .npy or raw) to replay instead of the microphone',
+                        type=str, nargs='?', default='')
+    parser.add_argument('--print', help='Print the target frequency of a few chunks instead of showing them',
+                        dest='print_target', action='store_true')
+    parser.add_argument('--fps', help='Frames drawn per second', type=float, default=60.)
+    parser.add_argument('--gain', help='Height of a ball per decade of magnitude', type=float, default=8.)
+    parser.add_argument('--stats_interval', help='Seconds between frame statistics, 0 for none', type=float,
+                        default=5.)
+    main(parser.parse_args())
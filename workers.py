@@ -0,0 +1,191 @@
+import multiprocessing
+import threading
+
+import numpy as np
+
+from metrics import clock
+from models import load_model
+
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
+
+def predicted_probability(clf, spectra, pred):
+    """
+    Probability the model gives its predicted class. Not the largest probability: with Platt scaling an SVC's
+    predicted class is not always the most probable one
+    :param clf: Classifier with predict_proba and classes_
+    :param spectra: (windows, bins) array the prediction was made on
+    :param pred: Predicted classes
+    :return: NumPy array, None when a predicted class is not one of classes_
+    """
+    proba = clf.predict_proba(spectra)
+    classes = np.asarray(clf.classes_)
+    index = np.minimum(np.searchsorted(classes, pred), len(classes) - 1)
+    if not np.array_equal(classes[index], pred):
+        return None
+    return proba[np.arange(len(pred)), index]
+
+
+def serve(clf_path, loader, shared, shape, tasks, results, confidence):
+    """
+    Worker process: predicts the batches written into the shared slots until it receives None
+    :param clf_path: Path of the model, loaded once by this process
+    :param loader: Function loading the model, called as loader(clf_path, mmap_mode)
+    :param shared: RawArray of the slots
+    :param shape: (slots, batch_size, width) of the shared array
+    :param tasks: Queue of (sequence number, slot, rows)
+    :param results: Queue the (sequence number, slot, predictions, confidences, error) are put on
+    :param confidence: Also compute the probability of each predicted class
+    :return: None
+    """
+    try:
+        # Memory mapped, so the workers share the pages of the model's arrays
+        clf = loader(clf_path, "r")
+        failure = None
+    except Exception as e:
+        clf = None
+        failure = "Could not load " + str(clf_path) + ": " + str(e)
+    slots = np.frombuffer(shared, dtype=np.float64).reshape(shape)
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        sequence, slot, rows = task
+        if failure is not None:
+            results.put((sequence, slot, None, None, failure))
+            continue
+        spectra = slots[slot, :rows]
+        try:
+            pred = np.asarray(clf.predict(spectra))
+        except Exception as e:
+            results.put((sequence, slot, None, None, str(e)))
+            continue
+        confidences = None
+        if confidence:
+            try:
+                confidences = predicted_probability(clf, spectra, pred)
+            except (AttributeError, NotImplementedError):
+                # The model has no probabilities, do not ask again
+                confidence = False
+            except Exception:
+                # The predictions are still good without them
+                confidences = None
+        results.put((sequence, slot, pred, confidences, None))
+
+
+class InferencePool(object):
+    """
+    Runs a model's predictions in worker processes, away from the GIL of the GUI and capture threads. Batches are
+    copied into slots of a shared memory array, only their slot number goes through the task queue. Results are
+    handed to the callback in the order the batches were submitted, whichever worker finishes first
+    """
+    def __init__(self, clf_path, width, batch_size, callback, processes=1, slots=0, confidence=False,
+                 loader=load_model, metrics=None, stage="predict"):
+        """
+        Start the worker processes
+        :param clf_path: Path of the PKL model each worker loads
+        :param width: Number of columns of a batch, the spectrum bins or features
+        :param batch_size: Most rows of a batch
+        :param callback: Called as callback(predictions, confidences, error) from the collector thread, once per
+        batch and in order. predictions is None when error is set
+        :param processes: Number of worker processes
+        :param slots: Number of batches in flight, defaults to two per worker. submit waits when all are in use
+        :param confidence: Also compute the probability of each predicted class
+        :param loader: Function loading the model in the workers, called as loader(clf_path, mmap_mode)
+        :param metrics: Metrics to record the submit to result time in, None to not record it
+        :param stage: Name the time is recorded under. The collector thread records it, so every pool needs a name
+        of its own
+        """
+        self.callback = callback
+        self.metrics = metrics
+        self.stage = stage
+        slots = slots or 2 * max(processes, 1)
+        self.shape = (slots, max(int(batch_size), 1), int(width))
+        self.shared = multiprocessing.RawArray('d', slots * self.shape[1] * self.shape[2])
+        self.slots = np.frombuffer(self.shared, dtype=np.float64).reshape(self.shape)
+        self.free = queue.Queue()
+        self.closed = False
+        for slot in range(slots):
+            self.free.put(slot)
+
+        self.tasks = multiprocessing.Queue()
+        self.results = multiprocessing.Queue()
+        self.processes = []
+        for _ in range(max(processes, 1)):
+            process = multiprocessing.Process(target=serve, name="InferenceWorker", args=(
+                clf_path, loader, self.shared, self.shape, self.tasks, self.results, confidence))
+            process.daemon = True
+            process.start()
+            self.processes.append(process)
+
+        # Sequence number of the next batch submitted and of the next one handed to the callback
+        self.submitted = 0
+        self.delivered = 0
+        # Results that arrived before an older batch, and when each batch was submitted
+        self.early = dict()
+        self.times = dict()
+        self.collector = threading.Thread(target=self.collect, name="InferenceCollector")
+        self.collector.daemon = True
+        self.collector.start()
+
+    def submit(self, spectra):
+        """
+        Queue a batch for prediction. Only waits when every slot is in flight
+        :param spectra: (rows, width) array, copied so the caller may reuse it
+        :return: None
+        :raises ValueError: When the pool is closed, or closes while waiting for a slot
+        """
+        while True:
+            if self.closed:
+                raise ValueError("Inference pool is closed")
+            try:
+                # Wakes up now and then, a slot is never freed again once the pool is closed
+                slot = self.free.get(timeout=0.1)
+                break
+            except queue.Empty:
+                pass
+        rows = len(spectra)
+        self.slots[slot, :rows] = spectra
+        self.times[self.submitted] = clock()
+        self.tasks.put((self.submitted, slot, rows))
+        self.submitted += 1
+
+    def collect(self):
+        """
+        Collector thread: frees the slot of every result and hands the results over in order
+        :return: None
+        """
+        while True:
+            item = self.results.get()
+            if item is None:
+                return
+            sequence, slot, pred, confidences, error = item
+            self.free.put(slot)
+            self.early[sequence] = (pred, confidences, error)
+            while self.delivered in self.early:
+                pred, confidences, error = self.early.pop(self.delivered)
+                submitted = self.times.pop(self.delivered, None)
+                if self.metrics is not None and submitted is not None:
+                    self.metrics.since(self.stage, submitted)
+                self.delivered += 1
+                self.callback(pred, confidences, error)
+
+    def close(self):
+        """
+        Finish the batches in flight and stop the workers. Submitting afterwards raises ValueError
+        :return: None
+        """
+        self.closed = True
+        if not self.processes:
+            return
+        for _ in self.processes:
+            self.tasks.put(None)
+        for process in self.processes:
+            process.join()
+        self.processes = []
+        # Workers only stop after their last result, so this comes after all of them
+        self.results.put(None)
+        self.collector.join()